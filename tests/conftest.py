@@ -0,0 +1,6 @@
+# modules of wavyMini import each other by their plain names
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..','wavyMini'))
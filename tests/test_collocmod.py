@@ -0,0 +1,58 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+from collocmod import collocate_spacetime
+
+basetime = datetime(2000,1,1)
+
+def make_track(dates,lats,lons,Hs):
+    '''
+    minimal satellite object as used by the collocation
+    '''
+    return SimpleNamespace(
+                time=np.array([(d - basetime).total_seconds()
+                               for d in dates]),
+                loc=[np.asarray(lats,dtype=float),
+                     np.asarray(lons,dtype=float)],
+                Hs=np.asarray(Hs,dtype=float),
+                basetime=basetime,timewin=30)
+
+def make_model():
+    model_lats = np.arange(0.,10.5,.5)
+    model_lons = np.arange(100.,110.5,.5)
+    model_time_dt = [datetime(2019,10,1,h) for h in range(0,4)]
+    # Hs grows by one meter per hour
+    model_Hs = (np.arange(1.,5.)[:,None,None]
+                * np.ones((1,len(model_lats),len(model_lons))))
+    return model_Hs, model_lats, model_lons, model_time_dt
+
+def test_spacetime_without_footprints_in_time_range():
+    model_Hs, model_lats, model_lons, model_time_dt = make_model()
+    sa_obj = make_track([datetime(2019,10,2,12)],[5.],[105.],[2.])
+    results = collocate_spacetime('SWAN',model_Hs,model_lats,model_lons,
+                                  model_time_dt,sa_obj,distlim=10)
+    for name in ['date_matches','dist_matches','model_Hs_matches',
+                 'sat_Hs_matches','model_lats_matches']:
+        assert len(results[name]) == 0
+    assert len(results['valid_date']) == len(model_time_dt)
+
+def test_spacetime_interpolates_in_time():
+    model_Hs, model_lats, model_lons, model_time_dt = make_model()
+    dates = [datetime(2019,10,1,0,30),datetime(2019,10,1,2,15)]
+    sa_obj = make_track(dates,[5.,5.],[105.,105.],[2.,2.])
+    results = collocate_spacetime('SWAN',model_Hs,model_lats,model_lons,
+                                  model_time_dt,sa_obj,distlim=10)
+    assert np.allclose(results['model_Hs_matches'],[1.5,3.25])
+    assert list(results['date_matches']) == dates
+
+def test_spacetime_keeps_edge_values_outside_time_range():
+    model_Hs, model_lats, model_lons, model_time_dt = make_model()
+    dates = [datetime(2019,9,30,23,30),datetime(2019,10,1,3,30)]
+    sa_obj = make_track(dates,[5.,5.],[105.,105.],[2.,2.])
+    results = collocate_spacetime('SWAN',model_Hs,model_lats,model_lons,
+                                  model_time_dt,sa_obj,
+                                  sdate=datetime(2019,9,30,23),
+                                  edate=datetime(2019,10,1,4),distlim=10)
+    assert np.allclose(results['model_Hs_matches'],[1.,4.])
@@ -0,0 +1,85 @@
+import os
+import ftplib
+import queue
+
+import ftpmod
+from ftpmod import ftp_session, download_worker
+
+content = b'0123456789' * 100
+
+class stub_ftp():
+    '''
+    minimal ftp object serving one file, records REST offsets
+    '''
+    def __init__(self,fail=False):
+        self.fail = fail
+        self.rests = []
+
+    def login(self,user,pw):
+        pass
+
+    def voidcmd(self,cmd):
+        pass
+
+    def size(self,remotefile):
+        return len(content)
+
+    def retrbinary(self,cmd,callback,rest=None):
+        if self.fail:
+            raise ftplib.error_temp('421 service not available')
+        self.rests.append(rest)
+        callback(content[rest or 0:])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+def test_retrieve_resumes_partial_file(tmp_path,monkeypatch):
+    target = str(tmp_path / 'swath.nc')
+    with open(target + '.part','wb') as f:
+        f.write(content[:300])
+    replaced = []
+    replace = os.replace
+    def record_replace(src,dst):
+        replaced.append((src,dst))
+        replace(src,dst)
+    monkeypatch.setattr(ftpmod.os,'replace',record_replace)
+    session = ftp_session('server','user','pw')
+    session.ftp = stub_ftp()
+    assert session.retrieve('/remote/swath.nc',target) == target
+    assert session.ftp.rests == [300]
+    assert replaced == [(target + '.part',target)]
+    assert not os.path.exists(target + '.part')
+    with open(target,'rb') as f:
+        assert f.read() == content
+
+def test_worker_does_not_wait_after_last_attempt(tmp_path,monkeypatch):
+    waits = []
+    monkeypatch.setattr(ftpmod.time,'sleep',waits.append)
+    monkeypatch.setattr(ftpmod,'FTP',
+                        lambda server,timeout=None: stub_ftp(fail=True))
+    jobs = queue.Queue()
+    jobs.put(('/remote/swath.nc',str(tmp_path / 'swath.nc')))
+    results = []
+    download_worker(jobs,results,'server','user','pw',3)
+    assert results == [('/remote/swath.nc',str(tmp_path / 'swath.nc'),
+                        False)]
+    assert len(waits) == 2
+    assert not os.path.exists(str(tmp_path / 'swath.nc'))
+
+def test_worker_continues_after_failing_callback(tmp_path,monkeypatch):
+    monkeypatch.setattr(ftpmod,'FTP',
+                        lambda server,timeout=None: stub_ftp())
+    jobs = queue.Queue()
+    for name in ['a.nc','b.nc']:
+        jobs.put(('/remote/' + name,str(tmp_path / name)))
+    called = []
+    def callback(target):
+        called.append(target)
+        raise IOError('cannot read ' + target)
+    results = []
+    download_worker(jobs,results,'server','user','pw',3,callback=callback)
+    assert called == [str(tmp_path / 'a.nc'),str(tmp_path / 'b.nc')]
+    assert [e[2] for e in results] == [True,True]
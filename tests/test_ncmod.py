@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import netCDF4
+import numpy as np
+
+from ncmod import dumptonc_ts
+
+basetime = datetime(2000,1,1)
+
+def make_results(n):
+    dates = [datetime(2019,10,1,0,i) for i in range(n)]
+    values = np.arange(n,dtype=float)
+    results = {'date_matches':dates,'dist_matches':values}
+    for name in ['Hs','lons','lats']:
+        results['model_' + name + '_matches'] = values
+        results['sat_' + name + '_matches'] = values
+    results['sat_count_matches'] = np.arange(1,n+1)
+    results['sat_Hs_std_matches'] = values/10
+    return results
+
+def test_dumptonc_ts_writes_superobs_statistics(tmp_path):
+    outpath = str(tmp_path) + '/'
+    dumptonc_ts(outpath,'ts.nc','test',basetime,make_results(3))
+    dumptonc_ts(outpath,'ts.nc','test',basetime,make_results(2))
+    with netCDF4.Dataset(outpath + 'ts.nc') as nc:
+        assert list(nc['count'][:]) == [1,2,3,1,2]
+        assert np.allclose(nc['Hs_std'][:],[0,.1,.2,0,.1])
+        assert nc['Hs_std'].units == 'm'
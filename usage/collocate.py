@@ -8,14 +8,22 @@ sys.path.append(wavypath)
 from datetime import datetime, timedelta
 from satmod import satellite_altimeter as sa
 from stationmod import matchtime
-from modelmod import get_model, check_date
-from collocmod import collocate
+from modelmod import get_model, get_model_fc_steps, check_date
+from regionmod import track_bbox
+from utils import timewin_idx
+import numpy as np
+from collocmod import collocate, collocate_spacetime, superobs
+from collocmod import collocation_pool, get_grid_key
 from copy import deepcopy
 from utils import grab_PID
 import argparse
 from argparse import RawTextHelpFormatter
 from ncmod import get_nc_time, dumptonc_ts
 from model_specs import model_dict
+from catalogmod import model_catalog
+import multiprocessing as mp
+from queue import Empty
+import traceback
 
 # parser
 parser = argparse.ArgumentParser(
@@ -25,6 +33,9 @@ If file exists, data is appended.
 
 Usage:
 ./collocate.py -sd 2019100118 -ed 2019100118 -sat c2 -mod SWAN -reg Vietnam
+./collocate.py -sd 2019100100 -ed 2019103118 -sat c2 -mod SWAN -reg Vietnam -mode file
+./collocate.py -sd 2019100100 -ed 2019103118 -sat c2 -mod SWAN -reg Vietnam -mode file -spacetime
+./collocate.py -sd 2019100100 -ed 2019103118 -sat c2 -mod SWAN -reg Vietnam -cache
     """,
     formatter_class = RawTextHelpFormatter
     )
@@ -44,6 +55,25 @@ parser.add_argument("-reg", metavar='region',
     help="region of interest")
 parser.add_argument("-path", metavar='destination',
     help="destination of collocated data")
+parser.add_argument("-lookahead", metavar='lookahead',
+    help="number of time steps read ahead of the collocation",
+    type = int)
+parser.add_argument("-superobs",
+    help="bin footprints per model grid cell before collocation",
+    action='store_const',const=True)
+parser.add_argument("-cache",
+    help="read footprints through the cache of decoded daily blocks",
+    action='store_const',const=True)
+parser.add_argument("-nproc", metavar='nproc',
+    help="number of simultaneous processes to scan model output\n"
+        + "and to collocate",type = int)
+parser.add_argument("-mode", metavar='mode',
+    help="loop over time steps (step) or over model files (file)",
+    choices=['step','file'])
+parser.add_argument("-spacetime",
+    help="interpolate model values linearly in time between the\n"
+        + "time steps of a model file, requires -mode file",
+    action='store_const',const=True)
 
 args = parser.parse_args()
 
@@ -69,6 +99,18 @@ if args.dist is None:
 if args.twin is None:
     args.twin = 60
 
+if args.lookahead is None:
+    args.lookahead = 2
+
+if args.mode is None:
+    args.mode = 'step'
+
+if (args.spacetime is True and args.mode != 'file'):
+    parser.error("-spacetime requires -mode file")
+
+if args.nproc is None:
+    args.nproc = 1
+
 # retrieve PID
 grab_PID()
 
@@ -76,54 +118,223 @@ grab_PID()
 forecasts = [0,6,12,18,24,30,36,42,48]
 
 # settings
-timewin = args.twin # minutes
-distlim = args.dist # km
+timewin = int(args.twin) # minutes
+distlim = float(args.dist) # km
 region = args.reg
 model = args.mod
 sat = args.sat
+lookahead = args.lookahead
+mode = args.mode
+
+# available model output initialised within the period
+catalog = model_catalog(model)
+catalog.update(sdate - timedelta(hours=max(forecasts)),edate,
+               corenum=args.nproc)
+catalog.close()
 
-tmpdate = deepcopy(sdate)
-while tmpdate <= edate:
+def load_step(fc_date,catalog):
+    """
+    read satellite window and model fields of all available
+    leadtimes for one time step
+    """
     # get s3a values
-    fc_date = deepcopy(tmpdate)
-    sa_obj = sa(fc_date,sat=args.sat,timewin=timewin,region=region)
-    if len(sa_obj.dtime)==0:
+    sa_obj = sa(fc_date,sat=sat,timewin=timewin,region=region,
+                cache=args.cache)
+    matches = []
+    if len(sa_obj.time)==0:
+        return sa_obj, matches
+    leadtimes = catalog.get_leadtimes(fc_date)
+    for element in forecasts:
+        if element not in leadtimes:
+            print("no model output for leadtime: ", element, "h")
+            continue
+        init_date = fc_date - timedelta(hours=element)
+        #get_model
+        try:
+            check_date(model,fc_date=fc_date,leadtime=element)
+            matches.append((fc_date,element,
+                get_model(simmode="fc",model=model,fc_date=fc_date,
+                init_date=init_date,leadtime=element,
+                sa_obj=sa_obj,distlim=distlim)))
+        except Exception as e:
+            print(e)
+    return sa_obj, matches
+
+def load_file(job,catalog):
+    """
+    read satellite data for the valid period of one model file
+    and all its time steps to be collocated at once
+    """
+    filestr, steps = job
+    fc_dates = [e[0] for e in steps]
+    sa_obj = sa(fc_dates[0],sat=sat,edate=fc_dates[-1],
+                timewin=timewin,region=region,cache=args.cache)
+    matches = []
+    if len(sa_obj.time)==0:
+        return sa_obj, matches
+    # skip time steps without footprints
+    collocated = [e for e in steps if len(np.arange(len(sa_obj.time))[
+                    timewin_idx(sa_obj.time,e[0],e[0],timewin=timewin,
+                                basetime=sa_obj.basetime,closed=True)])>0]
+    if len(collocated)==0:
+        return sa_obj, matches
+    # all time steps are needed to interpolate in time
+    if args.spacetime is not True:
+        steps = collocated
+    try:
+        model_Hs,model_lats,model_lons,model_time,model_time_dt = \
+            get_model_fc_steps(filestr=filestr,model=model,
+                fc_dates=[e[0] for e in steps],
+                bbox=track_bbox(sa_obj.loc[0],sa_obj.loc[1],
+                                distlim=distlim))
+    except Exception as e:
+        print(e)
+        return sa_obj, matches
+    for i in range(len(steps)):
+        if steps[i] not in collocated:
+            continue
+        if args.spacetime is True:
+            # time steps of the file are shared by all matches
+            matches.append((steps[i][0],steps[i][1],
+                            (model_Hs,model_lats,model_lons,
+                             model_time,model_time_dt)))
+        else:
+            matches.append((steps[i][0],steps[i][1],
+                            (model_Hs[i:i+1],model_lats,model_lons,
+                             model_time[i:i+1],model_time_dt[i:i+1])))
+    return sa_obj, matches
+
+def prefetch(loadfct,joblst,queue):
+    """
+    load jobs ahead of the collocation, the bounded
+    queue limits the look-ahead, errors are handed over
+    the queue and the end is always marked with None
+    """
+    try:
+        catalog = model_catalog(model)
+        try:
+            for job in joblst:
+                queue.put(loadfct(job,catalog))
+        finally:
+            catalog.close()
+    except Exception:
+        queue.put(RuntimeError(traceback.format_exc()))
+    finally:
+        queue.put(None)
+
+if mode == 'file':
+    # one job per model file with all time steps to collocate
+    catalog = model_catalog(model)
+    steps, inits = {}, {}
+    for valid, filestr, tidx, init, element in catalog.query(
+                                    sdate,edate,leadtime=forecasts):
+        if (valid - sdate).total_seconds() % (6*60*60) != 0:
+            continue
+        steps.setdefault(filestr,[]).append((valid,int(element)))
+        inits[filestr] = init
+    catalog.close()
+    joblst = [(filestr,steps[filestr]) for filestr in
+              sorted(steps,key=lambda e: (inits[e],e))]
+    loadfct = load_file
+else:
+    joblst = []
+    tmpdate = deepcopy(sdate)
+    while tmpdate <= edate:
+        joblst.append(deepcopy(tmpdate))
+        tmpdate = tmpdate + timedelta(hours=6)
+    loadfct = load_step
+
+def get_pool(pool,model_lats,model_lons,field_shape):
+    """
+    return a collocation pool of the model grid, the pool of the
+    previous grid is kept if the grid is unchanged
+    """
+    if pool is not None:
+        if pool.key == get_grid_key(model,model_lats,model_lons):
+            return pool
+        pool.close()
+    return collocation_pool(model,model_lats,model_lons,
+                            corenum=args.nproc,field_shape=field_shape)
+
+# reading of the next jobs overlaps with collocation and writing
+ctx = mp.get_context('fork')
+jobs = ctx.Queue(maxsize=lookahead)
+reader = ctx.Process(target=prefetch,args=(loadfct,joblst,jobs),
+                     daemon=True)
+reader.start()
+
+# workers collocating with the current model grid if nproc > 1
+pool = None
+while True:
+    try:
+        job = jobs.get(timeout=60)
+    except Empty:
+        # the reader may have been killed before sending None
+        if not reader.is_alive():
+            sys.exit('reader process died with exit code '
+                     + str(reader.exitcode))
+        continue
+    if job is None:
+        break
+    if isinstance(job,Exception):
+        raise job
+    sa_obj, matches = job
+    if len(sa_obj.time)==0:
         print("If possible proceed with another time step...")
-    else:
-        # loop over all forecast lead times
-        for element in forecasts:
-            print("leadtime: ", element, "h")
-            print("fc_date: ", fc_date)
-            basetime=model_dict[model]['basetime']
-            outpath=(args.path
-                    + '/'
-                    + 'CollocationFiles/'
-                    + sat
-                    + '/'
-                    + fc_date.strftime("%Y/%m/"))
-            os.system('mkdir -p ' + outpath)
-            filename_ts=fc_date.strftime(
-                                        model 
-                                        + "_vs_"
-                                        + sat
-                                        + "_coll_ts_lt"
-                                        + "{:0>3d}".format(element)
-                                        + "h_%Y%m.nc")
-            title_ts=('collocated time series for ' 
-                    + sat + ' vs ' + model + ' with leadtime '
-                    + "{:0>3d}".format(element)
-                    + ' h')
-            init_date = fc_date - timedelta(hours=element)
-            #get_model
-            try:
-                check_date(model,fc_date=fc_date,leadtime=element)
-                model_Hs,model_lats,model_lons,model_time,model_time_dt = \
-                    get_model(simmode="fc",model=model,fc_date=fc_date,
-                    init_date=init_date,leadtime=element)
-                #collocation
+        continue
+    # super-observations depend on the satellite data and the model
+    # grid only, which is the same for all lead times
+    sa_col = None if args.superobs is True else sa_obj
+    # loop over all forecast lead times and time steps
+    for fc_date, element, model_fields in matches:
+        print("leadtime: ", element, "h")
+        print("fc_date: ", fc_date)
+        basetime=model_dict[model]['basetime']
+        outpath=(args.path
+                + '/'
+                + 'CollocationFiles/'
+                + sat
+                + '/'
+                + fc_date.strftime("%Y/%m/"))
+        os.system('mkdir -p ' + outpath)
+        filename_ts=fc_date.strftime(
+                                    model 
+                                    + "_vs_"
+                                    + sat
+                                    + "_coll_ts_lt"
+                                    + "{:0>3d}".format(element)
+                                    + "h_%Y%m.nc")
+        title_ts=('collocated time series for ' 
+                + sat + ' vs ' + model + ' with leadtime '
+                + "{:0>3d}".format(element)
+                + ' h')
+        model_Hs,model_lats,model_lons,model_time,model_time_dt = \
+            model_fields
+        if args.spacetime is True:
+            field_shape = np.shape(model_Hs)[1:]
+        else:
+            field_shape = np.squeeze(model_Hs).shape
+        try:
+            if sa_col is None:
+                sa_col = superobs(sa_obj,model,model_lats,model_lons,
+                            field_shape=field_shape)
+            if args.nproc > 1:
+                pool = get_pool(pool,model_lats,model_lons,field_shape)
+            #collocation
+            if args.spacetime is True:
+                # footprints of the time window of fc_date
+                results_dict = collocate_spacetime(model,model_Hs,
+                    model_lats,model_lons,model_time_dt,sa_col,
+                    sdate=fc_date-timedelta(minutes=timewin),
+                    edate=fc_date+timedelta(minutes=timewin),
+                    distlim=distlim,pool=pool)
+            else:
                 results_dict = collocate(model,model_Hs,model_lats,
-                    model_lons,model_time_dt,sa_obj,fc_date,distlim=distlim)
-                dumptonc_ts(outpath,filename_ts,title_ts,basetime,results_dict)
-            except Exception as e: 
-                print(e)
-    tmpdate = tmpdate + timedelta(hours=6)
+                    model_lons,model_time_dt,sa_col,fc_date,
+                    distlim=distlim,pool=pool)
+            dumptonc_ts(outpath,filename_ts,title_ts,basetime,results_dict)
+        except Exception as e: 
+            print(e)
+if pool is not None:
+    pool.close()
+reader.join()
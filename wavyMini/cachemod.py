@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------#
+'''
+This module encompasses a disk cache of pre-decoded satellite
+altimeter footprints. Cleaned arrays are stored as one structured
+.npy-file per mission and day which can be memory-mapped. Blocks are
+keyed by the mtimes and sizes of their source files and evicted
+following a least recently used strategy within a disk budget.
+'''
+# --- import libraries ------------------------------------------------#
+'''
+List of libraries needed for this class.
+'''
+import os
+import hashlib
+
+# all class
+import numpy as np
+
+# get necessary paths for module
+import pathfinder
+
+# --- global functions ------------------------------------------------#
+
+# record layout of one footprint
+footprint_dtype = np.dtype([('time','f8'),
+                            ('latitude','f8'),
+                            ('longitude','f8'),
+                            ('VAVH','f8'),
+                            ('VAVH_smooth','f8')])
+
+def make_key(filelst):
+    '''
+    key of a block computed from (path,mtime,size) of its source files
+    '''
+    content = '\n'.join([os.path.basename(e[0])
+                        + ':' + repr(float(e[1]))
+                        + ':' + str(int(e[2]))
+                        for e in sorted(filelst)])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[0:16]
+
+# ---------------------------------------------------------------------#
+
+
+class footprint_cache():
+    '''
+    class to handle the cache of daily footprint blocks stored in
+    cachepath/sat/sat_%Y%m%d_key.npy
+    This class offers the following added functionality:
+     - load blocks memory-mapped if source files are unchanged
+     - store new blocks and remove outdated ones
+     - evict least recently used blocks exceeding the disk budget
+    '''
+    def __init__(self,cachepath=None,budget=None):
+        if cachepath is None:
+            cachepath = pathfinder.cachepath
+        if budget is None:
+            budget = pathfinder.cachebudget
+        self.cachepath = cachepath
+        self.budget = budget
+
+    def get_prefix(self,sat,day):
+        return os.path.join(self.cachepath,sat,
+                            sat + '_' + day.strftime('%Y%m%d') + '_')
+
+    def get(self,sat,day,filelst):
+        '''
+        returns the memory-mapped block or None if not available
+        '''
+        pathtofile = self.get_prefix(sat,day) + make_key(filelst) + '.npy'
+        if not os.path.isfile(pathtofile):
+            return None
+        # mark as recently used
+        os.utime(pathtofile,None)
+        return np.load(pathtofile,mmap_mode='r')
+
+    def put(self,sat,day,filelst,vardict):
+        '''
+        store a block from a dict of equally long arrays
+        '''
+        block = np.empty(len(vardict['time']),dtype=footprint_dtype)
+        for name in footprint_dtype.names:
+            block[name] = vardict[name]
+        prefix = self.get_prefix(sat,day)
+        pathtofile = prefix + make_key(filelst) + '.npy'
+        os.makedirs(os.path.dirname(prefix),exist_ok=True)
+        # remove outdated blocks of the same day
+        for entry in os.scandir(os.path.dirname(prefix)):
+            if (entry.path.startswith(prefix)
+            and entry.path != pathtofile):
+                os.remove(entry.path)
+        tmpfile = pathtofile + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpfile,'wb') as f:
+            np.save(f,block)
+        os.replace(tmpfile,pathtofile)
+        self.evict(keep=pathtofile)
+        return block
+
+    def evict(self,keep=None):
+        '''
+        remove least recently used blocks until the cache
+        fits into the disk budget
+        '''
+        if self.budget is None:
+            return
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.cachepath):
+            for name in filenames:
+                if name.endswith('.npy'):
+                    stat = os.stat(os.path.join(dirpath,name))
+                    entries.append((stat.st_mtime,stat.st_size,
+                                    os.path.join(dirpath,name)))
+        total = sum([e[1] for e in entries])
+        for mtime, size, pathtofile in sorted(entries):
+            if total <= self.budget:
+                break
+            if pathtofile == keep:
+                continue
+            os.remove(pathtofile)
+            total = total - size
@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------#
+'''
+This module keeps a persistent catalog of local satellite altimeter
+files. For each file the time coverage, bounding box, number of
+records and file stats are stored in a sqlite database such that
+files can be selected for a time window and region without listing
+directories or opening files. Similarly, model output is catalogued
+by valid time, file, time index, initialisation and leadtime.
+'''
+# --- import libraries ------------------------------------------------#
+'''
+List of libraries needed for this class.
+'''
+import os
+import re
+import sqlite3
+import threading
+
+# all class
+import numpy as np
+from datetime import datetime, timedelta
+
+# read_altim
+import netCDF4 as netCDF4
+
+# get_remote
+from dateutil.relativedelta import relativedelta
+
+# libraries for parallel computing
+from joblib import Parallel, delayed
+
+# get necessary paths for module
+import pathfinder
+
+# region spec
+from regionmod import region_bbox
+
+# --- global functions ------------------------------------------------#
+
+# the netCDF/HDF5 library is not thread-safe, download workers
+# read headers one at a time
+netcdf_lock = threading.Lock()
+
+def read_header(pathtofile):
+    '''
+    read time coverage, bounding box and number of records of a
+    swath file, time is given in seconds since 2000-01-01
+    '''
+    with netcdf_lock:
+        f = netCDF4.Dataset(pathtofile,'r')
+        time = f.variables['time'][:]
+        lats = f.variables['latitude'][:]
+        lons = ((f.variables['longitude'][:] - 180) % 360) - 180
+        f.close()
+    if len(time) < 1:
+        return None
+    return {'tmin':float(np.min(time)),
+            'tmax':float(np.max(time)),
+            'latmin':float(np.min(lats)),
+            'latmax':float(np.max(lats)),
+            'lonmin':float(np.min(lons)),
+            'lonmax':float(np.max(lons)),
+            'nrec':int(len(time))}
+
+def read_model_times(pathtofile,model):
+    '''
+    read time steps of a model file in seconds since the model
+    basetime, None if the file cannot be read
+    '''
+    from model_specs import model_dict
+    try:
+        f = netCDF4.Dataset(pathtofile,'r')
+        time = np.ma.filled(f.variables[model_dict[model]['time']][:],
+                            np.nan).astype('float64')
+        f.close()
+    except (IOError,OSError,KeyError):
+        print ("File could not be read: " + pathtofile)
+        return None
+    return time
+
+def get_localpath(destination,filename):
+    '''
+    local path of a swath file sorted by year and month of its
+    first time stamp: destination/%Y/%m/filename
+    '''
+    match = re.search(r'_(\d{4})(\d{2})\d{2}T\d{6}',filename)
+    if match is None:
+        return os.path.join(destination,filename)
+    return os.path.join(destination,match.group(1),match.group(2),filename)
+
+# ---------------------------------------------------------------------#
+
+
+class sat_catalog():
+    '''
+    class to handle the catalog of local swath files stored in
+    destination/year/month/
+    This class offers the following added functionality:
+     - incremental update of the catalog based on file stats
+     - register single files e.g. right after download
+     - select files for time window and region in one query
+    '''
+    basetime = datetime(2000,1,1)
+
+    def __init__(self,destination,dbfile=None):
+        if dbfile is None:
+            dbfile = os.path.join(destination,'catalog.sqlite')
+        self.destination = os.path.normpath(destination)
+        self.dbfile = dbfile
+        os.makedirs(destination,exist_ok=True)
+        # connection may be used by download workers, writes are
+        # serialized by the lock
+        self.con = sqlite3.connect(dbfile,timeout=60,
+                                   check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.con:
+            self.con.execute('CREATE TABLE IF NOT EXISTS files ('
+                            + 'path TEXT PRIMARY KEY, '
+                            + 'name TEXT, '
+                            + 'tmin REAL, tmax REAL, '
+                            + 'latmin REAL, latmax REAL, '
+                            + 'lonmin REAL, lonmax REAL, '
+                            + 'nrec INTEGER, '
+                            + 'mtime REAL, size INTEGER)')
+            self.con.execute('CREATE INDEX IF NOT EXISTS files_time '
+                            + 'ON files (tmin, tmax)')
+            self.con.execute('CREATE INDEX IF NOT EXISTS files_name '
+                            + 'ON files (name)')
+            # cached listings of remote directories
+            self.con.execute('CREATE TABLE IF NOT EXISTS remote ('
+                            + 'dirpath TEXT, name TEXT, '
+                            + 'size INTEGER, modify TEXT, '
+                            + 'fetched TEXT, '
+                            + 'PRIMARY KEY (dirpath, name))')
+            self.con.execute('CREATE TABLE IF NOT EXISTS remote_dirs ('
+                            + 'dirpath TEXT PRIMARY KEY, listed REAL)')
+
+    def close(self):
+        self.con.close()
+
+    def register(self,pathtofile,stat=None):
+        '''
+        add or replace a file in the catalog
+        '''
+        pathtofile = os.path.normpath(pathtofile)
+        if stat is None:
+            stat = os.stat(pathtofile)
+        try:
+            header = read_header(pathtofile)
+        except (IOError,OSError):
+            print ("File could not be read: " + pathtofile)
+            return False
+        if header is None:
+            # empty files are kept to avoid reading them again
+            header = dict.fromkeys(['tmin','tmax','latmin','latmax',
+                                    'lonmin','lonmax'])
+            header['nrec'] = 0
+        with self.lock, self.con:
+            self.con.execute('INSERT OR REPLACE INTO files VALUES '
+                            + '(?,?,?,?,?,?,?,?,?,?,?)',
+                            (pathtofile,os.path.basename(pathtofile),
+                            header['tmin'],header['tmax'],
+                            header['latmin'],header['latmax'],
+                            header['lonmin'],header['lonmax'],
+                            header['nrec'],stat.st_mtime,stat.st_size))
+        return True
+
+    def get_dirlst(self,sdate=None,edate=None):
+        '''
+        year/month directories covering the time period,
+        all directories if no period is given
+        '''
+        if sdate is None or edate is None:
+            dirlst = []
+            for year in sorted(os.listdir(self.destination)):
+                yearpath = os.path.join(self.destination,year)
+                if not (year.isdigit() and os.path.isdir(yearpath)):
+                    continue
+                for month in sorted(os.listdir(yearpath)):
+                    if os.path.isdir(os.path.join(yearpath,month)):
+                        dirlst.append(os.path.join(yearpath,month))
+            return dirlst
+        dirlst = []
+        tmpdate = datetime(sdate.year,sdate.month,1)
+        while tmpdate <= edate:
+            dirlst.append(os.path.join(self.destination,
+                                    str(tmpdate.year),
+                                    tmpdate.strftime('%m')))
+            tmpdate = tmpdate + relativedelta(months=+1)
+        return dirlst
+
+    def update(self,sdate=None,edate=None):
+        '''
+        register new or modified files and remove vanished files
+        in the directories covering the time period
+        '''
+        count = 0
+        for dirpath in self.get_dirlst(sdate,edate):
+            if not os.path.isdir(dirpath):
+                continue
+            known = dict(((row[0],(row[1],row[2])) for row in
+                        self.con.execute('SELECT path, mtime, size '
+                                        + 'FROM files '
+                                        + 'WHERE substr(path,1,?) = ?',
+                                        (len(os.path.join(dirpath,'')),
+                                        os.path.join(dirpath,'')))))
+            present = set()
+            for entry in os.scandir(dirpath):
+                if (not entry.is_file() or not entry.name.endswith('.nc')):
+                    continue
+                present.add(entry.path)
+                stat = entry.stat()
+                if known.get(entry.path) != (stat.st_mtime,stat.st_size):
+                    if self.register(entry.path,stat=stat):
+                        count = count + 1
+            vanished = [(p,) for p in known if p not in present]
+            if len(vanished) > 0:
+                with self.lock, self.con:
+                    self.con.executemany('DELETE FROM files WHERE path=?',
+                                        vanished)
+        if count > 0:
+            print (str(count) + " files added to catalog")
+        return count
+
+    def query(self,sdate,edate,region=None):
+        '''
+        paths of all files overlapping with [sdate,edate] and the
+        bounding box of the region, sorted by time
+        '''
+        tmin = (sdate - self.basetime).total_seconds()
+        tmax = (edate - self.basetime).total_seconds()
+        sql = ('SELECT path FROM files WHERE tmax >= ? AND tmin <= ?')
+        args = [tmin,tmax]
+        bbox = region_bbox(region)
+        if bbox is not None:
+            sql = sql + ' AND latmax >= ? AND latmin <= ?'
+            args = args + [bbox[0],bbox[1]]
+            # boxes crossing the dateline are not constrained in lon
+            if (bbox[2] <= bbox[3] and bbox[2] >= -180
+            and bbox[3] <= 180):
+                sql = sql + ' AND lonmax >= ? AND lonmin <= ?'
+                args = args + [bbox[2],bbox[3]]
+        sql = sql + ' ORDER BY tmin, path'
+        return [row[0] for row in self.con.execute(sql,args)]
+
+    def query_day(self,day):
+        '''
+        (path,mtime,size) of all files starting on the given day
+        '''
+        tmin = (day - self.basetime).total_seconds()
+        tmax = tmin + 24*60*60
+        sql = ('SELECT path, mtime, size FROM files '
+              + 'WHERE tmin >= ? AND tmin < ? ORDER BY tmin, path')
+        return [tuple(row) for row in self.con.execute(sql,(tmin,tmax))]
+
+    def get_local_sizes(self,names):
+        '''
+        dict of sizes of catalogued files by name
+        '''
+        sizes = {}
+        names = list(names)
+        for i in range(0,len(names),500):
+            sql = ('SELECT name, size FROM files WHERE name IN ('
+                  + ','.join(['?']*len(names[i:i+500])) + ')')
+            sizes.update(dict(self.con.execute(sql,names[i:i+500])))
+        return sizes
+
+    def get_remote_listing(self,dirpath):
+        '''
+        time of listing and cached list of (name,size,modify,fetched),
+        (None,[]) if the directory has not been listed before
+        '''
+        row = self.con.execute('SELECT listed FROM remote_dirs '
+                              + 'WHERE dirpath=?',(dirpath,)).fetchone()
+        if row is None:
+            return None, []
+        content = [tuple(e) for e in
+                    self.con.execute('SELECT name, size, modify, fetched '
+                                    + 'FROM remote WHERE dirpath=? '
+                                    + 'ORDER BY name',(dirpath,))]
+        return row[0], content
+
+    def set_remote_listing(self,dirpath,content,listed):
+        '''
+        store listing of (name,size,modify), the version of previously
+        fetched files is kept
+        '''
+        with self.lock, self.con:
+            self.con.execute('CREATE TEMP TABLE IF NOT EXISTS listing '
+                            + '(name TEXT PRIMARY KEY)')
+            self.con.execute('DELETE FROM listing')
+            self.con.executemany('INSERT OR IGNORE INTO listing VALUES (?)',
+                                [(e[0],) for e in content])
+            self.con.execute('DELETE FROM remote WHERE dirpath=? AND '
+                            + 'name NOT IN (SELECT name FROM listing)',
+                            (dirpath,))
+            self.con.executemany('INSERT INTO remote '
+                            + '(dirpath,name,size,modify) '
+                            + 'VALUES (?,?,?,?) '
+                            + 'ON CONFLICT (dirpath,name) DO UPDATE SET '
+                            + 'size=excluded.size, modify=excluded.modify',
+                            [(dirpath,e[0],e[1],e[2]) for e in content])
+            self.con.execute('INSERT OR REPLACE INTO remote_dirs '
+                            + 'VALUES (?,?)',(dirpath,listed))
+
+    def set_fetched(self,dirpath,names):
+        '''
+        mark the current remote version of files as fetched
+        '''
+        with self.lock, self.con:
+            self.con.executemany('UPDATE remote SET fetched=modify '
+                                + 'WHERE dirpath=? AND name=?',
+                                [(dirpath,name) for name in names])
+
+# ---------------------------------------------------------------------#
+
+
+class model_catalog():
+    '''
+    class to handle the catalog of model output files of one model
+    stored in pathfinder.catalogpath/model.sqlite
+    This class offers the following added functionality:
+     - scan the model directories of a period and read time axes
+       in parallel
+     - incremental update of the catalog based on file stats
+     - find file and time index for valid times and leadtimes
+    '''
+    def __init__(self,model,dbfile=None):
+        from model_specs import model_dict
+        if dbfile is None:
+            os.makedirs(pathfinder.catalogpath,exist_ok=True)
+            dbfile = os.path.join(pathfinder.catalogpath,model + '.sqlite')
+        self.model = model
+        self.path = os.path.normpath(model_dict[model]['path'])
+        self.file_template = model_dict[model]['file_template']
+        self.path_template = model_dict[model].get('path_template')
+        self.basetime = model_dict[model]['basetime']
+        self.dbfile = dbfile
+        self.con = sqlite3.connect(dbfile,timeout=60,
+                                   check_same_thread=False)
+        with self.con:
+            self.con.execute('CREATE TABLE IF NOT EXISTS files ('
+                            + 'path TEXT PRIMARY KEY, '
+                            + 'init REAL, mtime REAL, size INTEGER)')
+            self.con.execute('CREATE TABLE IF NOT EXISTS steps ('
+                            + 'path TEXT, tidx INTEGER, '
+                            + 'valid REAL, leadtime REAL, '
+                            + 'PRIMARY KEY (path, tidx))')
+            self.con.execute('CREATE INDEX IF NOT EXISTS steps_valid '
+                            + 'ON steps (valid, leadtime)')
+
+    def close(self):
+        self.con.close()
+
+    def get_init(self,filename,time):
+        '''
+        initialisation in seconds since basetime from the file name,
+        first time step if the name does not follow the template
+        '''
+        try:
+            init = datetime.strptime(filename,self.file_template)
+        except ValueError:
+            if len(time) < 1:
+                return None
+            return float(np.nanmin(time))
+        return (init - self.basetime).total_seconds()
+
+    def get_dirlst(self,sdate,edate):
+        '''
+        directories of files initialised within the time period
+        following the path_template of the model, the model path
+        if there is no template
+        '''
+        if self.path_template is None:
+            return [self.path]
+        dirlst = []
+        tmpdate = datetime(sdate.year,sdate.month,sdate.day)
+        while tmpdate <= edate:
+            dirpath = os.path.normpath(tmpdate.strftime(self.path_template))
+            if dirpath not in dirlst:
+                dirlst.append(dirpath)
+            tmpdate = tmpdate + timedelta(days=1)
+        return dirlst
+
+    def update(self,sdate=None,edate=None,corenum=None):
+        '''
+        register new or modified files and remove vanished files,
+        time axes are read in parallel using corenum workers
+        sdate, edate -> period of initialisation, only the directories
+                        of this period are scanned, the whole model
+                        tree if no period is given
+        '''
+        if corenum is None:
+            corenum = 1
+        known = dict(((row[0],(row[1],row[2])) for row in
+                    self.con.execute('SELECT path, mtime, size FROM files')))
+        present = set()
+        changed = []
+        if sdate is None or edate is None:
+            entries = []
+            for dirpath, dirnames, filenames in os.walk(self.path):
+                dirnames.sort()
+                entries += [os.path.join(dirpath,name)
+                            for name in sorted(filenames)]
+        else:
+            dirlst = self.get_dirlst(sdate,edate)
+            known = dict((p,e) for p,e in known.items()
+                         if os.path.dirname(p) in dirlst)
+            entries = []
+            for dirpath in dirlst:
+                if os.path.isdir(dirpath):
+                    entries += sorted([e.path for e in os.scandir(dirpath)
+                                       if e.is_file()])
+        for pathtofile in entries:
+            if not pathtofile.endswith('.nc'):
+                continue
+            stat = os.stat(pathtofile)
+            present.add(pathtofile)
+            if known.get(pathtofile) != (stat.st_mtime,stat.st_size):
+                changed.append((pathtofile,stat))
+        times = Parallel(n_jobs=corenum)(
+                        delayed(read_model_times)(e[0],self.model)
+                        for e in changed
+                        )
+        vanished = [(p,) for p in known if p not in present]
+        with self.con:
+            self.con.executemany('DELETE FROM files WHERE path=?',
+                                vanished + [(e[0],) for e in changed])
+            self.con.executemany('DELETE FROM steps WHERE path=?',
+                                vanished + [(e[0],) for e in changed])
+            count = 0
+            for (pathtofile,stat), time in zip(changed,times):
+                if time is None:
+                    continue
+                init = self.get_init(os.path.basename(pathtofile),time)
+                self.con.execute('INSERT INTO files VALUES (?,?,?,?)',
+                                (pathtofile,init,
+                                stat.st_mtime,stat.st_size))
+                self.con.executemany('INSERT INTO steps VALUES (?,?,?,?)',
+                                [(pathtofile,i,float(time[i]),
+                                 (float(time[i]) - init)/3600.)
+                                 for i in range(len(time))
+                                 if not np.isnan(time[i])])
+                count = count + 1
+        if (count > 0 or len(vanished) > 0):
+            print (str(count) + " model files added to catalog, "
+                    + str(len(vanished)) + " removed")
+        return count
+
+    def query(self,sdate,edate=None,leadtime=None):
+        '''
+        list of (valid,path,tidx,init,leadtime) for all time steps
+        within [sdate,edate], sorted by valid time and leadtime
+        leadtime -> hours, or list of hours, to restrict the query
+        '''
+        if edate is None:
+            edate = sdate
+        sql = ('SELECT s.valid, s.path, s.tidx, f.init, s.leadtime '
+              + 'FROM steps s JOIN files f ON s.path = f.path '
+              + 'WHERE s.valid >= ? AND s.valid <= ?')
+        args = [(sdate - self.basetime).total_seconds() - 1e-3,
+                (edate - self.basetime).total_seconds() + 1e-3]
+        if leadtime is not None:
+            if np.isscalar(leadtime):
+                leadtime = [leadtime]
+            sql = (sql + ' AND s.leadtime IN ('
+                  + ','.join(['?']*len(leadtime)) + ')')
+            args = args + [float(e) for e in leadtime]
+        sql = sql + ' ORDER BY s.valid, s.leadtime, s.path'
+        return [(self.basetime + timedelta(seconds=round(row[0],6)),
+                 row[1], row[2],
+                 self.basetime + timedelta(seconds=round(row[3],6)),
+                 row[4])
+                for row in self.con.execute(sql,args)]
+
+    def get_leadtimes(self,fc_date):
+        '''
+        dict of available leadtimes in hours and (path,tidx)
+        for a valid time
+        '''
+        return dict(((e[4],(e[1],e[2])) for e in self.query(fc_date)))
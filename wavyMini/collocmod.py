@@ -5,101 +5,753 @@
 """
 import sys
 import numpy as np
-from utils import progress
+import multiprocessing as mp
 from region_specs import region_dict
 from model_specs import model_dict
-from stationmod import matchtime
-from utils import haversine
-
-def collocation_loop(
-    j,sat_time_dt,model_time_dt_valid,distlim,model,
-    sat_rlats,sat_rlons,sat_rHs,
-    model_rlats,model_rlons,model_rHs,
-    moving_win
-    ):
-    from utils import haversine
-    lat_win = 0.1
-    if model in model_dict:
-        sat_rlat=sat_rlats[j]
-        sat_rlon=sat_rlons[j]
-        # constraints to reduce workload
-        if (model == 'SWAN'):
-            model_rlons_M, model_rlats_M = np.meshgrid(
-                                            model_rlons, model_rlats
-                                            )
-            model_rlats_flat = model_rlats_M.flatten()
-            model_rlons_flat = model_rlons_M.flatten()
-            model_rlons = model_rlons_flat
-            model_rlats = model_rlats_flat
-        model_rlats_new=model_rlats[
-                    (model_rlats>=sat_rlat-lat_win)
-                    &
-                    (model_rlats<=sat_rlat+lat_win)
-                    &
-                    (model_rlons>=sat_rlon-moving_win)
-                    &
-                    (model_rlons<=sat_rlon+moving_win)
-                    ]
-        model_rlons_new=model_rlons[
-                    (model_rlats>=sat_rlat-lat_win)
-                    &
-                    (model_rlats<=sat_rlat+lat_win)
-                    &
-                    (model_rlons>=sat_rlon-moving_win)
-                    &
-                    (model_rlons<=sat_rlon+moving_win)
-                    ]
-        tmp=range(len(model_rlats))
-        tmp_idx=np.array(tmp)[
-                    (model_rlats>=sat_rlat-lat_win)
-                    &
-                    (model_rlats<=sat_rlat+lat_win)
-                    &
-                    (model_rlons>=sat_rlon-moving_win)
-                    &
-                    (model_rlons<=sat_rlon+moving_win)
-                    ]
-        # compute distances
-        if sys.version_info <= (3, 0):
-            distlst=map(
-                        haversine,
-                        [sat_rlon]*len(model_rlons_new),
-                        [sat_rlat]*len(model_rlons_new),
-                        model_rlons_new,model_rlats_new
-                        )
+from utils import haversine_pairwise, timewin_idx, idx_array
+from utils import seconds_to_dtime
+
+def lonlat2xyz(lons,lats):
+    """
+    transform lons/lats in degrees to cartesian coordinates
+    on the unit sphere
+    """
+    lons = np.radians(np.asarray(lons,dtype='float64')).ravel()
+    lats = np.radians(np.asarray(lats,dtype='float64')).ravel()
+    coslats = np.cos(lats)
+    return np.column_stack((coslats*np.cos(lons),
+                            coslats*np.sin(lons),
+                            np.sin(lats)))
+
+class spherical_index():
+    '''
+    nearest-neighbour index of a model grid on the unit sphere
+    built once per model grid and queried for all footprints
+    in one vectorized call
+    '''
+    def __init__(self,model_lats,model_lons):
+        from scipy.spatial import cKDTree
+        self.lats = np.asarray(model_lats).ravel()
+        self.lons = np.asarray(model_lons).ravel()
+        self.tree = cKDTree(lonlat2xyz(self.lons,self.lats))
+
+    def query(self,lats,lons):
+        '''
+        returns great circle distances in km and flat grid indices
+        of the nearest grid points
+        '''
+        chord, idx = self.tree.query(lonlat2xyz(lons,lats))
+        dist = haversine_pairwise(np.ravel(lons),np.ravel(lats),
+                                  self.lons[idx],self.lats[idx])
+        return dist, idx
+
+    def query_k(self,lats,lons,k):
+        '''
+        returns great circle distances in km and flat grid indices
+        of the k nearest grid points, arrays of shape (n,k)
+        '''
+        k = min(int(k),len(self.lats))
+        chord, idx = self.tree.query(lonlat2xyz(lons,lats),k=k)
+        idx = np.asarray(idx).reshape((-1,k))
+        dist = haversine_pairwise(np.ravel(lons)[:,None],
+                                  np.ravel(lats)[:,None],
+                                  self.lons[idx],self.lats[idx])
+        return dist, idx
+
+    def query_radius(self,lats,lons,radius):
+        '''
+        returns footprint numbers, flat grid indices and great circle
+        distances in km of all grid points within radius in km
+        '''
+        # chord length on the unit sphere, earth radius as in haversine
+        chord = 2*np.sin(radius/(2*6367.))
+        hits = self.tree.query_ball_point(lonlat2xyz(lons,lats),chord)
+        rows = np.repeat(np.arange(len(hits)),[len(e) for e in hits])
+        idx = np.array([i for e in hits for i in e],dtype=int)
+        dist = haversine_pairwise(np.ravel(lons)[rows],np.ravel(lats)[rows],
+                                  self.lons[idx],self.lats[idx])
+        return rows, idx, dist
+
+    def coords(self,idx):
+        '''
+        returns lats and lons of flat grid indices
+        '''
+        return self.lats[idx], self.lons[idx]
+
+class regular_grid_index():
+    '''
+    nearest-neighbour search on rectilinear grids with 1-D lat/lon
+    axes using index arithmetic, only the bracketing grid points
+    are checked with the exact distance
+    '''
+    def __init__(self,model_lats,model_lons):
+        self.lats = np.asarray(model_lats,dtype='float64').ravel()
+        self.lons = np.asarray(model_lons,dtype='float64').ravel()
+        self.shape = (len(self.lats),len(self.lons))
+        # sorted axes and their original positions
+        self.lat_order = np.argsort(self.lats,kind='stable')
+        self.lon_order = np.argsort(self.lons,kind='stable')
+        self.lats_sorted = self.lats[self.lat_order]
+        self.lons_sorted = self.lons[self.lon_order]
+        # grids spanning the globe wrap around in longitude
+        if len(self.lons)>1:
+            dlon = np.max(np.diff(self.lons_sorted))
+            self.periodic = (self.lons_sorted[-1]
+                            - self.lons_sorted[0] + dlon >= 360.)
+        else:
+            self.periodic = False
+        # longitudes of footprints are wrapped into [lon0,lon0+360)
+        if self.periodic:
+            self.lon0 = self.lons_sorted[0]
+        else:
+            self.lon0 = (self.lons_sorted[0] + self.lons_sorted[-1])/2. - 180.
+
+    def bracket(self,axis,values,periodic=False):
+        '''
+        indices of the two sorted axis points enclosing values
+        '''
+        k = np.searchsorted(axis,values)
+        if periodic:
+            return (k-1) % len(axis), k % len(axis)
+        return np.clip(k-1,0,len(axis)-1), np.clip(k,0,len(axis)-1)
+
+    def native(self,lats,lons):
+        '''
+        returns footprint coordinates in the convention of the axes
+        '''
+        lats = np.asarray(lats,dtype='float64').ravel()
+        lons = np.asarray(lons,dtype='float64').ravel()
+        # shift to longitude convention of model grid
+        return lats, (lons - self.lon0) % 360. + self.lon0
+
+    def candidates(self,lats,lons):
+        '''
+        returns flat indices of the 2x2 grid points bracketing
+        footprints given in the convention of the axes, shape (n,4)
+        '''
+        ilat = np.column_stack(self.bracket(self.lats_sorted,lats))
+        ilon = np.column_stack(self.bracket(self.lons_sorted,lons,
+                                            periodic=self.periodic))
+        clat = np.repeat(ilat,2,axis=1)
+        clon = np.tile(ilon,(1,2))
+        return (self.lat_order[clat] * self.shape[1]
+                + self.lon_order[clon])
+
+    def query(self,lats,lons):
+        '''
+        returns great circle distances in km and flat grid indices
+        of the nearest grid points
+        '''
+        lats = np.asarray(lats,dtype='float64').ravel()
+        lons = np.asarray(lons,dtype='float64').ravel()
+        cidx = self.candidates(*self.native(lats,lons))
+        clats, clons = self.coords(cidx)
+        dists = haversine_pairwise(lons[:,None],lats[:,None],clons,clats)
+        best = np.argmin(dists,axis=1) if len(lats)>0 \
+                else np.zeros(0,dtype=int)
+        rows = np.arange(len(lats))
+        return dists[rows,best], cidx[rows,best]
+
+    def bilinear(self,lats,lons):
+        '''
+        returns flat grid indices and weights of the four grid points
+        enclosing each footprint, arrays of shape (n,4), and a mask
+        of footprints within the grid
+        '''
+        lats, lons = self.native(lats,lons)
+        if min(self.shape) < 2:
+            return (np.zeros((len(lats),4),dtype=int),
+                    np.zeros((len(lats),4)),
+                    np.zeros(len(lats),dtype=bool))
+        klat = np.clip(np.searchsorted(self.lats_sorted,lats,side='right'),
+                       1,self.shape[0]-1)
+        inside = ((lats >= self.lats_sorted[0])
+                 & (lats <= self.lats_sorted[-1]))
+        wlat = ((lats - self.lats_sorted[klat-1])
+               / (self.lats_sorted[klat] - self.lats_sorted[klat-1]))
+        if self.periodic:
+            klon = np.searchsorted(self.lons_sorted,lons,side='right')
+            ilon0 = (klon-1) % self.shape[1]
+            ilon1 = klon % self.shape[1]
+            wlon = (((lons - self.lons_sorted[ilon0]) % 360.)
+                   / ((self.lons_sorted[ilon1]
+                      - self.lons_sorted[ilon0]) % 360.))
+        else:
+            klon = np.clip(np.searchsorted(self.lons_sorted,lons,
+                                           side='right'),
+                           1,self.shape[1]-1)
+            ilon0, ilon1 = klon-1, klon
+            inside = (inside & (lons >= self.lons_sorted[0])
+                     & (lons <= self.lons_sorted[-1]))
+            wlon = ((lons - self.lons_sorted[ilon0])
+                   / (self.lons_sorted[ilon1] - self.lons_sorted[ilon0]))
+        ilat0 = self.lat_order[klat-1]
+        ilat1 = self.lat_order[klat]
+        ilon0 = self.lon_order[ilon0]
+        ilon1 = self.lon_order[ilon1]
+        idx = np.column_stack((ilat0*self.shape[1] + ilon0,
+                               ilat0*self.shape[1] + ilon1,
+                               ilat1*self.shape[1] + ilon0,
+                               ilat1*self.shape[1] + ilon1))
+        weights = np.column_stack(((1-wlat)*(1-wlon),(1-wlat)*wlon,
+                                   wlat*(1-wlon),wlat*wlon))
+        return idx, weights, inside
+
+    def coords(self,idx):
+        '''
+        returns lats and lons of flat grid indices
+        '''
+        ilat, ilon = np.divmod(idx,self.shape[1])
+        return self.lats[ilat], self.lons[ilon]
+
+class projected_grid_index(regular_grid_index):
+    '''
+    index of curvilinear grids that are rectilinear in the native
+    projection of the model (e.g. rotated pole), footprints are
+    transformed once with pyproj and searched with index arithmetic
+    on the native axes, distances are computed from the true
+    positions of the grid points
+    '''
+    def __init__(self,proj,native_y,native_x,model_lats,model_lons):
+        self.proj = proj
+        # geographic projections (e.g. ob_tran) return radians
+        self.angular = proj.crs.is_geographic
+        regular_grid_index.__init__(self,native_y,native_x)
+        if not self.angular:
+            self.periodic = False
+        self.grid_lats = np.asarray(model_lats,dtype='float64').ravel()
+        self.grid_lons = np.asarray(model_lons,dtype='float64').ravel()
+
+    def native(self,lats,lons):
+        '''
+        returns footprint coordinates in the native projection
+        '''
+        x, y = self.proj(np.asarray(lons,dtype='float64').ravel(),
+                         np.asarray(lats,dtype='float64').ravel())
+        if self.angular:
+            x = (np.degrees(x) - self.lon0) % 360. + self.lon0
+            y = np.degrees(y)
+        return np.asarray(y), np.asarray(x)
+
+    def coords(self,idx):
+        '''
+        returns lats and lons of flat grid indices
+        '''
+        return self.grid_lats[idx], self.grid_lons[idx]
+
+def get_projected_index(proj4,model_lats,model_lons):
+    """
+    return a projected_grid_index if the 2-D model grid is
+    rectilinear in the projection given by proj4, else None
+    """
+    import pyproj
+    proj = pyproj.Proj(proj4)
+    x, y = proj(np.asarray(model_lons,dtype='float64'),
+                np.asarray(model_lats,dtype='float64'))
+    if proj.crs.is_geographic:
+        x, y = np.degrees(x), np.degrees(y)
+    native_x, native_y = x[0,:], y[:,0]
+    if min(x.shape) < 2:
+        return None
+    # coordinates are often stored in single precision
+    tol = 1e-2 * min(np.min(np.abs(np.diff(native_x))),
+                     np.min(np.abs(np.diff(native_y))))
+    if (np.max(np.abs(x - native_x[None,:])) > tol
+    or np.max(np.abs(y - native_y[:,None])) > tol):
+        return None
+    return projected_grid_index(proj,native_y,native_x,
+                                model_lats,model_lons)
+
+def get_grid_key(model,model_lats,model_lons,nsample=None):
+    """
+    key of a model grid from shapes, dtypes and a sample of nsample
+    (default 64) evenly spaced coordinates, which distinguishes the
+    subsets of a model grid without copying the whole grid
+    """
+    if nsample is None:
+        nsample = 64
+    key = [model]
+    for coords in (np.asarray(model_lats),np.asarray(model_lons)):
+        sample = np.linspace(0,coords.size-1,
+                             min(coords.size,nsample)).astype(int)
+        key.append((coords.shape,coords.dtype.str,
+                    coords.flat[sample].tobytes()))
+    return tuple(key)
+
+# indices of recently used grids, least recently used are dropped
+grid_index_dict = {}
+
+def get_grid_index(model,model_lats,model_lons,field_shape=None,
+    grid_key=None):
+    """
+    return the spatial index of a model grid, build it if necessary
+    the index type is chosen from the dimensionality of the grid,
+    field_shape resolves 1-D axes of equal length, 2-D grids of
+    models with a proj4 definition are searched in native coordinates
+    grid_key -> key of the grid if known, see get_grid_key
+    """
+    model_lats = np.asarray(model_lats)
+    model_lons = np.asarray(model_lons)
+    if grid_key is None:
+        grid_key = get_grid_key(model,model_lats,model_lons)
+    if grid_key in grid_index_dict:
+        grid_index_dict[grid_key] = grid_index_dict.pop(grid_key)
+        return grid_index_dict[grid_key]
+    if (len(model_lats.shape)==1 and len(model_lons.shape)==1
+    and (model_lats.shape!=model_lons.shape
+    or (field_shape is not None and len(field_shape)==2))):
+        print ("Building regular grid index for model grid ...")
+        grid_index = regular_grid_index(model_lats,model_lons)
+    else:
+        grid_index = None
+        proj4 = model_dict.get(model,{}).get('proj4')
+        if (proj4 is not None and len(model_lats.shape)==2
+        and model_lats.shape==model_lons.shape):
+            print ("Building projected grid index for model grid ...")
+            grid_index = get_projected_index(proj4,model_lats,model_lons)
+        if grid_index is None:
+            print ("Building spatial index for model grid ...")
+            grid_index = spherical_index(model_lats,model_lons)
+    grid_index.key = grid_key
+    # grids subset to the track change with every time step
+    if len(grid_index_dict) >= 4:
+        grid_index_dict.pop(next(iter(grid_index_dict)))
+    grid_index_dict[grid_key] = grid_index
+    return grid_index
+
+def get_point_index(model,model_lats,model_lons,field_shape=None,
+    grid_key=None):
+    """
+    return a spatial index over all grid points, 1-D axes are
+    expanded to the full grid in the order of the flattened fields
+    """
+    grid_index = get_grid_index(model,model_lats,model_lons,
+                                field_shape=field_shape,grid_key=grid_key)
+    if isinstance(grid_index,spherical_index):
+        return grid_index
+    # kept with the grid index and dropped together with it
+    if getattr(grid_index,'points',None) is None:
+        print ("Building spatial index for model grid points ...")
+        lats, lons = grid_index.coords(
+                        np.arange(grid_index.shape[0]*grid_index.shape[1]))
+        grid_index.points = spherical_index(lats,lons)
+    return grid_index.points
+
+class collocation_weights():
+    '''
+    sparse weights mapping flattened model fields to footprints,
+    computed once per grid and track set and applied to any field
+    on this grid, e.g. for further leadtimes or variables
+    '''
+    def __init__(self,matrix,dists,idx):
+        self.matrix = matrix # (footprints, grid points)
+        self.dists = dists # distances to nearest grid points in km
+        self.idx = idx # flat indices of nearest grid points
+
+    def apply(self,field):
+        '''
+        returns weighted model values per footprint, weights are
+        renormalized over valid (>=0) grid values and nan is returned
+        where none are left, leading dimensions of field (e.g. time)
+        are kept as trailing dimension
+        '''
+        field = np.ma.filled(np.ma.array(field,dtype='float64'),np.nan)
+        npts = self.matrix.shape[1]
+        values = self.combine(field.reshape((-1,npts)).T)
+        if values.shape[1] == 1:
+            return values[:,0]
+        return values
+
+    def combine(self,columns):
+        '''
+        returns weighted values of columns of shape (grid points, m)
+        as array of shape (footprints, m)
+        '''
+        with np.errstate(invalid='ignore'):
+            good = columns >= 0
+        num = self.matrix.dot(np.where(good,columns,0.))
+        den = self.matrix.dot(good.astype('float64'))
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.where(den>0,num/np.where(den>0,den,1.),np.nan)
+
+# weights of recent track sets
+weights_dict = {}
+
+def get_weights(model,model_lats,model_lons,lats,lons,method=None,
+    distlim=None,k=None,field_shape=None,grid_key=None):
+    """
+    return collocation weights of footprints for a model grid
+    method -> nearest: nearest grid point within distlim
+              bilinear: four enclosing points of rectilinear grids
+              idw: inverse distance weighted k nearest within distlim
+              radius: mean of all grid points within distlim
+    footprints farther than distlim from the grid get no weights
+    grid_key -> key of the grid if known, see get_grid_key
+    """
+    from scipy.sparse import csr_matrix
+    if method is None:
+        method = 'nearest'
+    if distlim is None:
+        distlim = int(6)
+    if k is None:
+        k = 4
+    lats = np.asarray(lats,dtype='float64').ravel()
+    lons = np.asarray(lons,dtype='float64').ravel()
+    grid_index = get_grid_index(model,model_lats,model_lons,
+                                field_shape=field_shape,grid_key=grid_key)
+    key = (grid_index.key,method,distlim,k,len(lats),
+           hash(lats.tobytes()),hash(lons.tobytes()))
+    if key in weights_dict:
+        return weights_dict[key]
+    if isinstance(grid_index,regular_grid_index):
+        npts = grid_index.shape[0]*grid_index.shape[1]
+    else:
+        npts = len(grid_index.lats)
+    dists, idx = grid_index.query(lats,lons)
+    near = dists <= distlim
+    rows = np.arange(len(lats))
+    if method == 'nearest':
+        rows, cols, data = rows[near], idx[near], np.ones(np.sum(near))
+    elif method == 'bilinear':
+        if not isinstance(grid_index,regular_grid_index):
+            raise ValueError('bilinear interpolation requires a '
+                            + 'rectilinear grid')
+        cols, data, inside = grid_index.bilinear(lats,lons)
+        use = near & inside
+        rows = np.repeat(rows[use],4)
+        cols, data = cols[use].ravel(), data[use].ravel()
+    elif method == 'idw':
+        point_index = get_point_index(model,model_lats,model_lons,
+                                      field_shape=field_shape,
+                                      grid_key=grid_key)
+        kdists, cols = point_index.query_k(lats,lons,k)
+        use = (kdists <= distlim) & near[:,None]
+        # exact hits dominate, distances are in km
+        data = 1./np.maximum(kdists,1e-6)**2
+        rows = np.repeat(rows[:,None],cols.shape[1],axis=1)[use]
+        cols, data = cols[use], data[use]
+    elif method == 'radius':
+        point_index = get_point_index(model,model_lats,model_lons,
+                                      field_shape=field_shape,
+                                      grid_key=grid_key)
+        rows, cols, rdists = point_index.query_radius(lats,lons,distlim)
+        use = rdists <= distlim
+        rows, cols = rows[use], cols[use]
+        data = np.ones(len(rows))
+    else:
+        raise ValueError('unknown collocation method: ' + str(method))
+    weights = collocation_weights(
+                csr_matrix((data,(rows,cols)),shape=(len(lats),npts)),
+                dists,idx)
+    # track sets change with every time window, keep only a few
+    if len(weights_dict) >= 8:
+        weights_dict.pop(next(iter(weights_dict)))
+    weights_dict[key] = weights
+    return weights
+
+class shared_array():
+    '''
+    numpy array in shared memory, pickled by the name of the
+    segment so that worker processes attach without a copy
+    '''
+    def __init__(self,array=None,shape=None,dtype=None):
+        from multiprocessing import shared_memory
+        if array is not None:
+            array = np.ascontiguousarray(array)
+            shape, dtype = array.shape, array.dtype
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True,size=max(1,size))
+        self.owner = True
+        self.array = np.ndarray(self.shape,dtype=self.dtype,
+                                buffer=self.shm.buf)
+        if array is not None:
+            self.array[...] = array
+
+    def __getstate__(self):
+        return {'name':self.shm.name,'shape':self.shape,
+                'dtype':self.dtype.str}
+
+    def __setstate__(self,state):
+        from multiprocessing import shared_memory
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.owner = False
+        self.array = np.ndarray(self.shape,dtype=self.dtype,
+                                buffer=self.shm.buf)
+
+    def close(self):
+        '''
+        detach from the segment, the creator also removes it
+        '''
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class pooled_weights(collocation_weights):
+    '''
+    collocation weights applied by the workers of a collocation_pool
+    '''
+    def __init__(self,matrix,dists,idx,pool):
+        collocation_weights.__init__(self,matrix,dists,idx)
+        self.pool = pool
+
+    def apply(self,field):
+        return self.pool.apply(self,field)
+
+# model grid of the collocation worker, see pool_init
+pool_state = {}
+
+def pool_init(model,model_lats,model_lons,field_shape,method,grid_key):
+    """
+    attach the shared model grid in a worker process, indices built
+    before the fork are found in grid_index_dict, else built once
+    """
+    pool_state.update({'model':model,'model_lats':model_lats,
+                       'model_lons':model_lons,
+                       'field_shape':field_shape,
+                       'grid_key':grid_key})
+    get_grid_index(model,model_lats.array,model_lons.array,
+                   field_shape=field_shape,grid_key=grid_key)
+    if method in ('idw','radius'):
+        get_point_index(model,model_lats.array,model_lons.array,
+                        field_shape=field_shape,grid_key=grid_key)
+
+def weights_worker(args):
+    """
+    weights of one chunk of footprints, distances and indices are
+    written to the shared output arrays
+    """
+    lats, lons, start, dists, idx, method, distlim, k = args
+    weights = get_weights(pool_state['model'],
+                          pool_state['model_lats'].array,
+                          pool_state['model_lons'].array,
+                          lats,lons,method=method,distlim=distlim,k=k,
+                          field_shape=pool_state['field_shape'],
+                          grid_key=pool_state['grid_key'])
+    dists.array[start:start+len(lats)] = weights.dists
+    idx.array[start:start+len(lats)] = weights.idx
+    dists.close()
+    idx.close()
+    return weights.matrix
+
+def apply_worker(args):
+    """
+    apply weights to one block of time steps of a shared field
+    and write to the shared output array
+    """
+    matrix, field, values, t0, t1 = args
+    columns = field.array.reshape((-1,matrix.shape[1]))[t0:t1].T
+    values.array[:,t0:t1] = collocation_weights(matrix,None,None).combine(
+                                columns)
+    columns = None
+    field.close()
+    values.close()
+
+class collocation_pool():
+    '''
+    worker processes collocating footprints with one model grid
+    The model grid is published once in shared memory and its index
+    is built before the workers are forked, so workers attach without
+    copies. Footprints are split in chunks to compute weights and
+    fields in blocks of time steps to apply them, results are written
+    to preallocated shared arrays. The grid is keyed once, see
+    get_grid_key, and the key is handed to the workers.
+    method -> idw or radius to build the point index before the fork
+    '''
+    def __init__(self,model,model_lats,model_lons,corenum=None,
+        field_shape=None,method=None):
+        if corenum is None:
+            corenum = 1
+        self.model = model
+        self.corenum = corenum
+        self.key = get_grid_key(model,model_lats,model_lons)
+        self.model_lats = shared_array(model_lats)
+        self.model_lons = shared_array(model_lons)
+        grid_index = get_grid_index(model,self.model_lats.array,
+                                    self.model_lons.array,
+                                    field_shape=field_shape,
+                                    grid_key=self.key)
+        if method in ('idw','radius'):
+            get_point_index(model,self.model_lats.array,
+                            self.model_lons.array,field_shape=field_shape,
+                            grid_key=self.key)
+        if isinstance(grid_index,regular_grid_index):
+            self.npts = grid_index.shape[0]*grid_index.shape[1]
         else:
-            distlst=list(map(
-                        haversine,
-                        [sat_rlon]*len(model_rlons_new),
-                        [sat_rlat]*len(model_rlons_new),
-                        model_rlons_new,model_rlats_new
-                        ))
-        tmp_idx2 = distlst.index(np.min(distlst))
-        idx_valid = tmp_idx[tmp_idx2]
-        if (distlst[tmp_idx2]<=distlim and model_rHs[idx_valid]>=0):
-            nearest_all_dist_matches=distlst[tmp_idx2]
-            nearest_all_date_matches=sat_time_dt[j]
-            nearest_all_model_Hs_matches=\
-                           model_rHs[idx_valid]
-            nearest_all_sat_Hs_matches=sat_rHs[j]
-            nearest_all_sat_lons_matches=sat_rlon
-            nearest_all_sat_lats_matches=sat_rlat
-            nearest_all_model_lons_matches=\
-                            model_rlons[idx_valid]
-            nearest_all_model_lats_matches=\
-                            model_rlats[idx_valid]
-            return nearest_all_date_matches,nearest_all_dist_matches,\
-                nearest_all_model_Hs_matches,nearest_all_sat_Hs_matches,\
-                nearest_all_sat_lons_matches, nearest_all_sat_lats_matches,\
-                nearest_all_model_lons_matches, nearest_all_model_lats_matches
+            self.npts = len(grid_index.lats)
+        ctx = mp.get_context('fork')
+        self.pool = ctx.Pool(corenum,initializer=pool_init,
+                             initargs=(model,self.model_lats,
+                                       self.model_lons,field_shape,method,
+                                       self.key))
+
+    def get_weights(self,lats,lons,method=None,distlim=None,k=None):
+        '''
+        return collocation weights of footprints, see get_weights
+        '''
+        from scipy.sparse import vstack, csr_matrix
+        lats = np.asarray(lats,dtype='float64').ravel()
+        lons = np.asarray(lons,dtype='float64').ravel()
+        dists = shared_array(shape=(len(lats),),dtype='float64')
+        idx = shared_array(shape=(len(lats),),dtype='int64')
+        bounds = np.linspace(0,len(lats),2*self.corenum+1).astype(int)
+        tasks = [(lats[a:b],lons[a:b],a,dists,idx,method,distlim,k)
+                 for a, b in zip(bounds[:-1],bounds[1:]) if b > a]
+        try:
+            matrices = self.pool.map(weights_worker,tasks)
+            if len(matrices) > 0:
+                matrix = vstack(matrices,format='csr')
+            else:
+                matrix = csr_matrix((0,self.npts))
+            weights = pooled_weights(matrix,dists.array.copy(),
+                                     idx.array.copy(),self)
+        finally:
+            dists.close()
+            idx.close()
+        return weights
+
+    def share(self,field):
+        '''
+        publish a field in shared memory to be applied several times
+        without copies, the caller releases it with close()
+        '''
+        return shared_array(
+                np.ma.filled(np.ma.array(field,dtype='float64'),np.nan))
+
+    def apply(self,weights,field):
+        '''
+        returns weighted model values per footprint, see
+        collocation_weights.apply, leading dimensions of field are
+        split in blocks over the workers, field may be published
+        with share()
+        '''
+        if isinstance(field,shared_array):
+            shared = field
         else:
-           return
+            field = np.ma.filled(np.ma.array(field,dtype='float64'),np.nan)
+            if field.size < 2*self.npts:
+                return collocation_weights.apply(weights,field)
+            shared = shared_array(field)
+        ntime = int(np.prod(shared.shape)) // self.npts
+        values = shared_array(shape=(weights.matrix.shape[0],ntime),
+                              dtype='float64')
+        bounds = np.linspace(0,ntime,min(ntime,self.corenum)+1).astype(int)
+        try:
+            self.pool.map(apply_worker,
+                          [(weights.matrix,shared,values,a,b)
+                           for a, b in zip(bounds[:-1],bounds[1:])])
+            result = values.array.copy()
+        finally:
+            if shared is not field:
+                shared.close()
+            values.close()
+        if ntime == 1:
+            return result[:,0]
+        return result
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.model_lats.close()
+        self.model_lons.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def superobs(sa_obj,model=None,model_lats=None,model_lons=None,
+    distance=None,deltalim=None,field_shape=None):
+    """
+    bin consecutive footprints to super-observations, bins end at
+    gaps in time larger than deltalim seconds (default 3) and when
+    the nearest model grid cell changes or, if distance in km is
+    given, every distance km along track
+    returns a copy of sa_obj with mean time, position and Hs per bin
+    and the number of footprints (count) and std of Hs (Hs_std)
+    field_shape resolves 1-D axes of equal length, see get_grid_index
+    """
+    from copy import copy
+    from utils import block_detection
+    if deltalim is None:
+        deltalim = 3
+    time = np.asarray(sa_obj.time,dtype='float64')
+    lats = np.asarray(sa_obj.loc[0],dtype='float64')
+    lons = np.asarray(sa_obj.loc[1],dtype='float64')
+    Hs = np.asarray(sa_obj.Hs,dtype='float64')
+    keep = ~np.isnan(Hs)
+    time, lats, lons, Hs = time[keep], lats[keep], lons[keep], Hs[keep]
+    # track segments
+    idx_a, idx_b, blocklst = block_detection(time,deltalim=deltalim)
+    boundary = np.zeros(len(time),dtype=bool)
+    if len(time) > 0:
+        boundary[0] = True
+        boundary[idx_a] = True
+    if distance is not None:
+        step = np.zeros(len(time))
+        step[1:] = haversine_pairwise(lons[:-1],lats[:-1],lons[1:],lats[1:])
+        step[boundary] = 0
+        # along track distance restarting in each segment
+        cumdist = np.cumsum(step)
+        starts = np.where(boundary)[0]
+        seglen = np.diff(np.append(starts,len(time)))
+        cumdist = cumdist - np.repeat(cumdist[starts],seglen)
+        cell = np.floor(cumdist/distance)
+    elif model_lats is not None:
+        grid_index = get_grid_index(model,model_lats,model_lons,
+                                    field_shape=field_shape)
+        cell = grid_index.query(lats,lons)[1]
+    else:
+        raise ValueError('superobs requires a model grid or a distance')
+    boundary[1:] = boundary[1:] | (cell[1:] != cell[:-1])
+    starts = np.where(boundary)[0]
+    count = np.diff(np.append(starts,len(time)))
+    def binmean(values):
+        if len(values) == 0:
+            return values
+        return np.add.reduceat(values,starts)/count
+    # longitudes relative to first footprint of bin for the dateline
+    lon0 = np.repeat(lons[starts],count)
+    Hs_mean = binmean(Hs)
+    Hs_var = binmean(Hs**2) - Hs_mean**2
+    reduced = copy(sa_obj)
+    reduced.time = binmean(time)
+    reduced.loc = [binmean(lats),
+                   ((binmean(((lons - lon0 + 180) % 360) - 180)
+                     + lons[starts] + 180) % 360) - 180]
+    reduced.Hs = Hs_mean
+    reduced.Hs_std = np.sqrt(np.maximum(Hs_var,0))
+    reduced.Hs_smooth = Hs_mean
+    reduced.count = count
+    reduced.idx = np.asarray(sa_obj.idx)[keep][starts]
+    reduced.dtime = None
+    print ("Binned " + str(len(time)) + " footprints to "
+            + str(len(starts)) + " super-observations")
+    return reduced
 
 def collocate(model,model_Hs,model_lats,model_lons,model_time_dt,\
-    sa_obj,datein,distlim=None):
+    sa_obj,datein,distlim=None,method=None,k=None,pool=None):
     """
     get stellite time steps close to model time step. 
+    model_Hs may be a dict of fields by variable name, matches are
+    searched on Hs (or the first field) and all fields are attached
+    as model_<name>_matches
+    method -> nearest (default), bilinear, idw or radius, see get_weights
+    pool -> collocation_pool of the model grid to share the work
     """
+    if isinstance(model_Hs,dict):
+        fields = model_Hs
+        if 'Hs' in fields:
+            model_Hs = fields['Hs']
+        else:
+            model_Hs = fields[list(fields.keys())[0]]
+    else:
+        fields = {}
     if len(sa_obj.Hs)<1:
         raise Exception ( '\n###\n' 
                         + 'Collocation not possible, '
@@ -108,74 +760,154 @@ def collocate(model,model_Hs,model_lats,model_lons,model_time_dt,\
     if distlim is None:
         distlim = int(6)
     timewin = sa_obj.timewin
-    ctime, cidx = matchtime(datein,datein,sa_obj.time,
-                    sa_obj.basetime,timewin=sa_obj.timewin)
-    sat_time_dt=np.array(sa_obj.dtime)[cidx]
+    cidx = idx_array(timewin_idx(sa_obj.time,datein,datein,
+                                 timewin=sa_obj.timewin,
+                                 basetime=sa_obj.basetime,closed=True),
+                     len(sa_obj.time))
+    sat_time_dt=np.array(seconds_to_dtime(np.asarray(sa_obj.time)[cidx],
+                                          sa_obj.basetime),dtype=object)
     model_time_idx = model_time_dt.index(datein)
     model_time_dt_valid=[model_time_dt[model_time_idx]]
     print ("date matches found:")
     print (model_time_dt_valid)
-    # Compare wave heights of satellite with model with 
-    # constraint on distance and time frame
-    nearest_all_date_matches=[]
-    nearest_all_dist_matches=[]
-    nearest_all_model_Hs_matches=[]
-    nearest_all_sat_Hs_matches=[]
-    nearest_all_sat_lons_matches=[]
-    nearest_all_sat_lats_matches=[]
-    nearest_all_model_lons_matches=[]
-    nearest_all_model_lats_matches=[]
-    # create local variables before loop
-    sat_rlats=sa_obj.loc[0][cidx]
-    sat_rlons=sa_obj.loc[1][cidx]
+    # create local variables
+    sat_rlats=np.array(sa_obj.loc[0])[cidx]
+    sat_rlons=np.array(sa_obj.loc[1])[cidx]
     sat_rHs=np.array(sa_obj.Hs)[cidx]
-    # flatten numpy arrays
-    model_rHs = model_Hs.flatten()
-    model_rlons = model_lons.flatten()
-    model_rlats = model_lats.flatten()
-    # moving window compensating for increasing latitudes
-    try:
-        moving_win = round(
-                (distlim /
-                 haversine(0,
-                    np.max(np.abs(sat_rlats)),
-                    1,
-                    np.max(np.abs(sat_rlats)))
-                ),
-                2)
-        if moving_win == 0.0:
-            raise ValueError
-    except (ValueError):
-        moving_win = .6
-    print ("Searching for matches with moving window of degree:",\
-            moving_win)
-    for j in range(len(sat_time_dt)):
-        progress(j,str(int(len(sat_time_dt))),'')
-        try:
-            resultlst = collocation_loop(\
-                j,sat_time_dt,model_time_dt_valid,distlim,model,\
-                sat_rlats,sat_rlons,sat_rHs,\
-                model_rlats,model_rlons,model_rHs,moving_win)
-            nearest_all_date_matches.append(resultlst[0])
-            nearest_all_dist_matches.append(resultlst[1])
-            nearest_all_model_Hs_matches.append(resultlst[2])
-            nearest_all_sat_Hs_matches.append(resultlst[3])
-            nearest_all_sat_lons_matches.append(resultlst[4])
-            nearest_all_sat_lats_matches.append(resultlst[5])
-            nearest_all_model_lons_matches.append(resultlst[6])
-            nearest_all_model_lats_matches.append(resultlst[7])
-        except:
-            print ("Unexpected error:", sys.exc_info()[0])
-            pass
+    # find model grid points for all footprints at once
+    print ("Searching for matches within " + str(distlim) + "km")
+    if pool is None:
+        weights = get_weights(model,model_lats,model_lons,
+                              sat_rlats,sat_rlons,
+                              method=method,distlim=distlim,k=k,
+                              field_shape=np.squeeze(model_Hs).shape)
+    else:
+        weights = pool.get_weights(sat_rlats,sat_rlons,method=method,
+                                   distlim=distlim,k=k)
+    model_rHs = weights.apply(model_Hs)
+    # compare wave heights of satellite with model with
+    # constraint on distance and time frame
+    valid = (weights.dists<=distlim) & ~np.isnan(model_rHs)
+    grid_index = get_grid_index(model,model_lats,model_lons,
+                                field_shape=np.squeeze(model_Hs).shape,
+                                grid_key=getattr(pool,'key',None))
+    model_rlats, model_rlons = grid_index.coords(weights.idx[valid])
     results_dict = {
         'valid_date':np.array(model_time_dt_valid),
-        'date_matches':np.array(nearest_all_date_matches),
-        'dist_matches':np.array(nearest_all_dist_matches),
-        'model_Hs_matches':np.array(nearest_all_model_Hs_matches),
-        'sat_Hs_matches':np.array(nearest_all_sat_Hs_matches),
-        'sat_lons_matches':np.array(nearest_all_sat_lons_matches),
-        'sat_lats_matches':np.array(nearest_all_sat_lats_matches),
-        'model_lons_matches':np.array(nearest_all_model_lons_matches),
-        'model_lats_matches':np.array(nearest_all_model_lats_matches)
+        'date_matches':sat_time_dt[valid],
+        'dist_matches':weights.dists[valid],
+        'model_Hs_matches':model_rHs[valid],
+        'sat_Hs_matches':sat_rHs[valid],
+        'sat_lons_matches':sat_rlons[valid],
+        'sat_lats_matches':sat_rlats[valid],
+        'model_lons_matches':model_rlons,
+        'model_lats_matches':model_rlats
+        }
+    for name in fields:
+        results_dict['model_' + name + '_matches'] = \
+            weights.apply(fields[name])[valid]
+    # statistics of super-observations
+    for name in ['Hs_std','count']:
+        if hasattr(sa_obj,name):
+            results_dict['sat_' + name + '_matches'] = \
+                np.asarray(getattr(sa_obj,name))[cidx][valid]
+    return results_dict
+
+def collocate_spacetime(model,model_Hs,model_lats,model_lons,
+    model_time_dt,sa_obj,sdate=None,edate=None,distlim=None,
+    method=None,k=None,pool=None):
+    """
+    collocate all footprints within [sdate,edate], by default the
+    first and last model time step, with the nearest grid point,
+    model values are interpolated linearly in time between the two
+    bracketing model time steps, footprints before the first or after
+    the last time step get the values of this time step
+    model_Hs -> fields with time as first dimension or dict of those
+    model_time_dt -> datetime objects of the time steps of model_Hs
+    method -> nearest (default), bilinear, idw or radius, see get_weights
+    pool -> collocation_pool of the model grid to share the work
+    """
+    from utils import to_seconds
+    if isinstance(model_Hs,dict):
+        fields = model_Hs
+        if 'Hs' in fields:
+            model_Hs = fields['Hs']
+        else:
+            model_Hs = fields[list(fields.keys())[0]]
+    else:
+        fields = {}
+    if len(sa_obj.Hs)<1:
+        raise Exception ( '\n###\n' 
+                        + 'Collocation not possible, '
+                        + 'no values for collocation!'
+                        + '\n###')
+    if distlim is None:
+        distlim = int(6)
+    # model time axis in seconds since the satellite basetime
+    model_time = to_seconds(model_time_dt,sa_obj.basetime)
+    order = np.argsort(model_time,kind='stable')
+    model_time = model_time[order]
+    ntime = len(model_time)
+    if sdate is None:
+        sdate = model_time_dt[order[0]]
+    if edate is None:
+        edate = model_time_dt[order[-1]]
+    cidx = idx_array(timewin_idx(sa_obj.time,sdate,edate,timewin=0,
+                                 basetime=sa_obj.basetime,closed=True),
+                     len(sa_obj.time))
+    sat_time = np.asarray(sa_obj.time,dtype='float64')[cidx]
+    sat_rlats=np.array(sa_obj.loc[0])[cidx]
+    sat_rlons=np.array(sa_obj.loc[1])[cidx]
+    sat_rHs=np.array(sa_obj.Hs)[cidx]
+    # bracketing model time steps and weights
+    if ntime > 1:
+        tidx = np.clip(np.searchsorted(model_time,sat_time,side='right')-1,
+                       0,ntime-2)
+        tweights = np.clip((sat_time - model_time[tidx])
+                           / (model_time[tidx+1] - model_time[tidx]),0,1)
+    else:
+        tidx = np.zeros(len(sat_time),dtype=int)
+        tweights = np.zeros(len(sat_time))
+    tidx1 = np.minimum(tidx+1,ntime-1)
+    # model grid points for all footprints at once
+    print ("Searching for matches within " + str(distlim) + "km")
+    if pool is None:
+        weights = get_weights(model,model_lats,model_lons,
+                              sat_rlats,sat_rlons,
+                              method=method,distlim=distlim,k=k,
+                              field_shape=np.shape(model_Hs)[1:])
+    else:
+        weights = pool.get_weights(sat_rlats,sat_rlons,method=method,
+                                   distlim=distlim,k=k)
+    rows = np.arange(len(sat_time))
+    def interpolate(field):
+        values = weights.apply(field).reshape((len(sat_time),ntime))[:,order]
+        return (values[rows,tidx], values[rows,tidx1])
+    start, end = interpolate(model_Hs)
+    valid = ((weights.dists<=distlim) & ~np.isnan(start)
+             & ~np.isnan(end))
+    grid_index = get_grid_index(model,model_lats,model_lons,
+                                field_shape=np.shape(model_Hs)[1:],
+                                grid_key=getattr(pool,'key',None))
+    model_rlats, model_rlons = grid_index.coords(weights.idx[valid])
+    dists = weights.dists
+    tweights = tweights[valid]
+    results_dict = {
+        'valid_date':np.array(model_time_dt,dtype=object)[order],
+        'date_matches':np.array(seconds_to_dtime(sat_time[valid],
+                                                 sa_obj.basetime),
+                                dtype=object),
+        'dist_matches':dists[valid],
+        'model_Hs_matches':((1-tweights)*start[valid]
+                            + tweights*end[valid]),
+        'sat_Hs_matches':sat_rHs[valid],
+        'sat_lons_matches':sat_rlons[valid],
+        'sat_lats_matches':sat_rlats[valid],
+        'model_lons_matches':model_rlons,
+        'model_lats_matches':model_rlats
         }
+    for name in fields:
+        start, end = interpolate(fields[name])
+        results_dict['model_' + name + '_matches'] = \
+            (1-tweights)*start[valid] + tweights*end[valid]
     return results_dict
@@ -17,6 +17,8 @@ Download satellite netcdf from Copernicus DU.
 Usage:
 ./download.py
 ./download.py -sat s3a -sd 2019090100 -ed 2019090200
+./download.py -sat s3a -sd 2019090100 -ed 2019090200 -sync
+./download.py -sat s3a -sd 2019090100 -ed 2019090200 -ingest
     """,
     formatter_class = RawTextHelpFormatter
     )
@@ -30,6 +32,12 @@ parser.add_argument("-path", metavar='path',
     help="destination for downloaded data")
 parser.add_argument("-nproc", metavar='nproc',
     help="number of simultaneous processes",type = int)
+parser.add_argument("-sync",
+    help="only download new or changed files",
+    action='store_const',const=True)
+parser.add_argument("-ingest",
+    help="decode files while downloading and fill the footprint cache",
+    action='store_const',const=True)
 
 args = parser.parse_args()
 
@@ -67,6 +75,7 @@ print('destination: ' + destination)
 start_time = time.time()
 sa_obj = get_remotefiles(satpath, destination,
                         sdate,edate,timewin=30,
-                        corenum=nproc,download=True)
+                        corenum=nproc,download=True,sync=args.sync,
+                        ingest=args.ingest)
 time1 = time.time() - start_time
 print("Time used for collecting data: ", time1, " seconds")
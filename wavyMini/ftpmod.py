@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------#
+'''
+This module encompasses the download engine for satellite files.
+Each worker keeps a persistent authenticated ftp session and streams
+many files over it. Partial files are resumed, written to a temporary
+name and renamed atomically when complete.
+'''
+# --- import libraries ------------------------------------------------#
+'''
+List of libraries needed for this class.
+'''
+import os
+import time
+import random
+import ftplib
+from ftplib import FTP
+
+# libraries for parallel computing
+import threading
+import queue
+
+# --- global functions ------------------------------------------------#
+
+def backoff_time(attempt,base=None,maxwait=None):
+    '''
+    exponential backoff in seconds with random jitter
+    '''
+    if base is None:
+        base = 2.
+    if maxwait is None:
+        maxwait = 120.
+    return min(maxwait, base * 2**attempt) * random.uniform(.5,1.5)
+
+# ---------------------------------------------------------------------#
+
+
+class ftp_session():
+    '''
+    class to handle a persistent ftp session
+    This class offers the following added functionality:
+     - (re-)connect and login once for many files
+     - list remote directories
+     - retrieve files with resume and atomic rename
+    '''
+    def __init__(self,server,user,pw,timeout=None):
+        if timeout is None:
+            timeout = 60
+        self.server = server
+        self.user = user
+        self.pw = pw
+        self.timeout = timeout
+        self.ftp = None
+
+    def connect(self):
+        if self.ftp is None:
+            self.ftp = FTP(self.server,timeout=self.timeout)
+            self.ftp.login(self.user,self.pw)
+            self.ftp.voidcmd('TYPE I')
+        return self.ftp
+
+    def close(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except (ftplib.all_errors):
+                self.ftp.close()
+            self.ftp = None
+
+    def nlst(self,path):
+        return self.connect().nlst(path)
+
+    def listdir(self,path):
+        '''
+        returns list of (name,size,modify) of files in path,
+        MLSD is used if supported by the server
+        '''
+        ftp = self.connect()
+        try:
+            return [(name,int(facts['size']),facts['modify'])
+                    for name, facts in ftp.mlsd(path,
+                                    facts=['type','size','modify'])
+                    if facts.get('type','file') == 'file']
+        except ftplib.error_perm:
+            content = []
+            for name in [os.path.basename(e) for e in ftp.nlst(path)]:
+                size = self.size(path + name)
+                try:
+                    modify = ftp.voidcmd('MDTM ' + path + name)[4:].strip()
+                except ftplib.error_perm:
+                    modify = None
+                content.append((name,size,modify))
+            return content
+
+    def size(self,remotefile):
+        try:
+            return self.connect().size(remotefile)
+        except ftplib.error_perm:
+            return None
+
+    def retrieve(self,remotefile,target):
+        '''
+        download remotefile to target, a partial download in
+        target.part is resumed using REST
+        '''
+        ftp = self.connect()
+        os.makedirs(os.path.dirname(os.path.abspath(target)),exist_ok=True)
+        tmpfile = target + '.part'
+        size = self.size(remotefile)
+        offset = 0
+        if os.path.isfile(tmpfile):
+            offset = os.path.getsize(tmpfile)
+            if (size is not None and offset > size):
+                offset = 0
+        mode = 'ab' if offset > 0 else 'wb'
+        if (size is None or offset < size):
+            with open(tmpfile,mode) as f:
+                if offset > 0:
+                    try:
+                        ftp.retrbinary('RETR ' + remotefile, f.write,
+                                       rest=offset)
+                    except (ftplib.error_perm,ftplib.error_reply):
+                        # server does not support REST, start over
+                        f.seek(0)
+                        f.truncate()
+                        ftp.retrbinary('RETR ' + remotefile, f.write)
+                else:
+                    ftp.retrbinary('RETR ' + remotefile, f.write)
+        if (size is not None and os.path.getsize(tmpfile) != size):
+            raise IOError('incomplete file ' + remotefile)
+        os.replace(tmpfile,target)
+        return target
+
+def download_worker(jobs,results,server,user,pw,retries,
+    callback=None):
+    '''
+    retrieve files from queue over one persistent session,
+    callback is called with the path of each completed file,
+    failures of the callback are reported and do not stop the worker
+    '''
+    session = ftp_session(server,user,pw)
+    while True:
+        try:
+            remotefile, target = jobs.get_nowait()
+        except queue.Empty:
+            break
+        for attempt in range(retries):
+            try:
+                session.retrieve(remotefile,target)
+            except (ftplib.all_errors + (IOError,)) as e:
+                session.close()
+                if attempt == retries - 1:
+                    # no retry follows
+                    print ("Download of " + os.path.basename(remotefile)
+                            + " failed (" + str(e) + ")")
+                    continue
+                wait = backoff_time(attempt)
+                print ("Download of " + os.path.basename(remotefile)
+                        + " failed (" + str(e) + "), retry in "
+                        + '{:0.1f}'.format(wait) + " sec")
+                time.sleep(wait)
+            else:
+                results.append((remotefile,target,True))
+                if callback is not None:
+                    try:
+                        callback(target)
+                    except Exception as e:
+                        print ("Processing of " + os.path.basename(target)
+                                + " failed (" + str(e) + ")")
+                break
+        else:
+            results.append((remotefile,target,False))
+        jobs.task_done()
+    session.close()
+
+def download_files(filelst,server,path,destination,user,pw,
+    corenum=None,retries=None,targetlst=None,callback=None):
+    '''
+    download files from server:path to destination using corenum
+    workers each keeping one ftp session
+    targetlst -> local paths of files, default is destination/name
+    callback -> fct called with the path of each completed file,
+                called concurrently by the workers
+    returns lists of downloaded and failed files
+    '''
+    if corenum is None:
+        corenum = 1
+    if retries is None:
+        retries = 10
+    if targetlst is None:
+        targetlst = [os.path.join(destination,name) for name in filelst]
+    jobs = queue.Queue()
+    for name, target in zip(filelst,targetlst):
+        jobs.put((path + name, target))
+    results = []
+    workers = [threading.Thread(target=download_worker,
+                                args=(jobs,results,server,user,pw,retries,
+                                      callback))
+               for i in range(max(1,min(corenum,len(filelst))))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    downloaded = [e[1] for e in results if e[2] is True]
+    failed = [e[0] for e in results if e[2] is False]
+    if len(failed)>0:
+        print ('Download failed for ' + str(len(failed)) + ' files:')
+        for e in failed:
+            print (e)
+    return downloaded, failed
@@ -23,6 +23,7 @@ import argparse
 from argparse import RawTextHelpFormatter
 import os
 import math
+from collections import OrderedDict
 
 # progress bar
 from utils import progress, hour_rounder
@@ -50,6 +51,95 @@ definition of some global functions.
 # ---------------------------------------------------------------------#
 
 
+class model_file_cache():
+    '''
+    class to keep model files open over many reads
+    Per file the Dataset handle and the immutable grid and time
+    metadata are stored. Entries are evicted least recently used
+    first when the number of entries or the size of the metadata
+    exceeds the budget. Files modified on disk are reopened.
+    '''
+    def __init__(self,maxentries=None,maxbytes=None):
+        if maxentries is None:
+            maxentries = pathfinder.modelcache_entries
+        if maxbytes is None:
+            maxbytes = pathfinder.modelcache_bytes
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+
+    def get(self,filestr,model):
+        '''
+        returns dict with dataset, lats, lons, time, time_dt,
+        time_index (datetime -> index), ydim and xdim
+        lats, lons and time are shared by all callers and read-only,
+        modifying them in place raises a ValueError, copy them first
+        '''
+        from utils import seconds_to_dtime
+        stat = os.stat(filestr)
+        key = (filestr,model)
+        entry = self.entries.get(key)
+        if (entry is not None
+        and entry['stat'] == (stat.st_mtime,stat.st_size)):
+            self.entries.move_to_end(key)
+            return entry
+        if entry is not None:
+            self.remove(key)
+        f = netCDF4.Dataset(filestr,'r')
+        model_time = f.variables[model_dict[model]['time']][:]
+        model_time_dt = seconds_to_dtime(np.ma.filled(model_time,np.nan),
+                                         model_dict[model]['basetime'])
+        lat_var = f.variables[model_dict[model]['lats']]
+        lon_var = f.variables[model_dict[model]['lons']]
+        model_lats = lat_var[:]
+        model_lons = lon_var[:]
+        # dimensions of the grid in the order (y,x)
+        if len(lat_var.dimensions) == 1 and len(lon_var.dimensions) == 1:
+            ydim, xdim = lat_var.dimensions[0], lon_var.dimensions[0]
+        else:
+            ydim, xdim = lat_var.dimensions[-2:]
+        # metadata is shared between calls and must not be modified
+        for arr in [model_time, model_lats, model_lons]:
+            arr.flags.writeable = False
+        entry = {'dataset':f,
+                 'stat':(stat.st_mtime,stat.st_size),
+                 'lats':model_lats,
+                 'lons':model_lons,
+                 'time':model_time,
+                 'time_dt':model_time_dt,
+                 'time_index':dict((d,i) for i,d in
+                                   enumerate(model_time_dt)),
+                 'ydim':ydim,
+                 'xdim':xdim,
+                 'nbytes':(model_time.nbytes + model_lats.nbytes
+                           + model_lons.nbytes)}
+        self.entries[key] = entry
+        self.evict(keep=key)
+        return entry
+
+    def remove(self,key):
+        entry = self.entries.pop(key)
+        entry['dataset'].close()
+
+    def evict(self,keep=None):
+        '''
+        remove least recently used entries exceeding the budget
+        '''
+        for key in list(self.entries.keys()):
+            nbytes = sum([e['nbytes'] for e in self.entries.values()])
+            if (len(self.entries) <= self.maxentries
+            and nbytes <= self.maxbytes):
+                break
+            if key != keep:
+                self.remove(key)
+
+    def clear(self):
+        for key in list(self.entries.keys()):
+            self.remove(key)
+
+# open model files are shared for the lifetime of the process
+model_files = model_file_cache()
+
 class model_class():
     '''
     class to read and process model data 
@@ -127,49 +217,166 @@ def get_model_filepathlst(simmode=None,model=None,sdate=None,edate=None,
         filepathlst = [filestr]
     return filepathlst
 
+def get_subset_slices(model_lats,model_lons,bbox):
+    """
+    index ranges of the grid covering bbox, for 1-D axes slices
+    refer to (lats,lons) and for 2-D coordinates to (y,x)
+    None if no grid point is within bbox
+    """
+    from regionmod import lon_mask
+    lat_hits = ((model_lats >= bbox[0]) & (model_lats <= bbox[1]))
+    lon_hits = lon_mask(model_lons,bbox[2],bbox[3])
+    if len(model_lats.shape) == 1 and len(model_lons.shape) == 1:
+        yidx = np.where(lat_hits)[0]
+        xidx = np.where(lon_hits)[0]
+    else:
+        hits = lat_hits & lon_hits
+        yidx = np.where(np.any(hits,axis=1))[0]
+        xidx = np.where(np.any(hits,axis=0))[0]
+    if len(yidx) == 0 or len(xidx) == 0:
+        return None
+    return slice(yidx[0],yidx[-1]+1), slice(xidx[0],xidx[-1]+1)
+
+def read_fields(entry,model,varlst,tidx,bbox=None):
+    """
+    read hyperslabs of the variables in varlst for time index or
+    list of time indices tidx from a cached model file, bbox
+    restricts the read to [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon]
+    for a list tidx time is moved to the first dimension of the fields
+    returns dict of fields by name, lats and lons
+    """
+    f = entry['dataset']
+    model_lats = entry['lats']
+    model_lons = entry['lons']
+    yslice, xslice = slice(None), slice(None)
+    if bbox is not None:
+        slices = get_subset_slices(model_lats,model_lons,bbox)
+        if slices is None:
+            print ("No grid points within bounding box, read full grid")
+        else:
+            yslice, xslice = slices
+            if len(model_lats.shape) == 1 and len(model_lons.shape) == 1:
+                model_lats = model_lats[yslice]
+                model_lons = model_lons[xslice]
+            else:
+                model_lats = model_lats[yslice,xslice]
+                model_lons = model_lons[yslice,xslice]
+    # read hyperslab of the chosen time step(s) for all variables
+    # e.g. Hs [time,lat,lon]
+    fields = {}
+    for name in varlst:
+        var = f.variables[model_dict[model][name]]
+        hyperslab = []
+        for dim in var.dimensions:
+            if dim == model_dict[model]['time']:
+                hyperslab.append(tidx)
+            elif dim == entry['ydim']:
+                hyperslab.append(yslice)
+            elif dim == entry['xdim']:
+                hyperslab.append(xslice)
+            else:
+                hyperslab.append(slice(None))
+        fields[name] = var[tuple(hyperslab)]
+        if not np.isscalar(tidx):
+            if model_dict[model]['time'] not in var.dimensions:
+                raise ValueError(model_dict[model][name] + ' has no '
+                                + 'dimension ' + model_dict[model]['time']
+                                + ' ' + str(var.dimensions))
+            fields[name] = np.moveaxis(fields[name],
+                        var.dimensions.index(model_dict[model]['time']),0)
+    return fields, model_lats, model_lons
+
 def get_model_fc_mode(filestr=None,model=None,fc_date=None,
-    init_date=None,leadtime=None,varname=None):
+    init_date=None,leadtime=None,varname=None,bbox=None):
     """ 
     fct to get model data
+    only the time step fc_date is read, bbox restricts the read to
+    the part of the grid within [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon]
+    varname -> name in model_dict or list of names, for a list a dict
+               of fields by name is returned
+    model_lats and model_lons are read-only views of the file cache,
+    see model_file_cache.get
     """
-    from utils import haversine
-    import glob
     print ("Get model data according to selected date ....")
     print(filestr)
-    f = netCDF4.Dataset(filestr,'r')
-    model_lons = f.variables[model_dict[model]['lons']][:]
-    model_lats = f.variables[model_dict[model]['lats']][:]
-    model_time = f.variables[model_dict[model]['time']][:]
-    # Hs [time,lat,lon]
-    if (varname == 'Hs' or varname is None):
-        model_Hs = f.variables[model_dict[model]['Hs']][:].squeeze()
-    else: 
-        model_Hs = f.variables[model_dict[model][varname]][:].squeeze()
-    f.close()
-    model_basetime = model_dict[model]['basetime']
-    model_time_dt=[]
-    for element in model_time:
-        element = float(element)
-        model_time_dt.append(model_basetime
-                + timedelta(seconds=element))
-    model_time_dt_valid = [model_time_dt[model_time_dt.index(fc_date)]]
-    model_time_valid = [model_time[model_time_dt.index(fc_date)]]
-    if len(model_Hs.shape)>2:
-        model_Hs_valid = model_Hs[model_time_dt.index(fc_date),:,:].squeeze()
+    entry = model_files.get(filestr,model)
+    if fc_date not in entry['time_index']:
+        raise ValueError(str(fc_date) + ' is not in ' + filestr)
+    tidx = entry['time_index'][fc_date]
+    model_time_dt_valid = [entry['time_dt'][tidx]]
+    model_time_valid = [entry['time'][tidx]]
+    if varname is None:
+        varname = 'Hs'
+    if isinstance(varname,str):
+        varlst = [varname]
+    else:
+        varlst = list(varname)
+    fields, model_lats, model_lons = read_fields(entry,model,varlst,
+                                                 tidx,bbox=bbox)
+    for name in fields:
+        fields[name] = fields[name].squeeze()
+    if isinstance(varname,str):
+        model_Hs_valid = fields[varname]
     else:
-        model_Hs_valid = model_Hs[:,:].squeeze()
+        model_Hs_valid = fields
     return model_Hs_valid, model_lats, model_lons, model_time_valid,\
          model_time_dt_valid
 
+def get_model_fc_steps(filestr=None,model=None,fc_dates=None,
+    varname=None,bbox=None):
+    """
+    fct to get several time steps of one model file in one read
+    model_Hs is returned with time as first dimension, or as dict
+    of such fields for a list of varnames
+    model_lats and model_lons are read-only views of the file cache,
+    see model_file_cache.get
+    """
+    print ("Get model data for " + str(len(fc_dates)) + " time steps ....")
+    print(filestr)
+    entry = model_files.get(filestr,model)
+    for fc_date in fc_dates:
+        if fc_date not in entry['time_index']:
+            raise ValueError(str(fc_date) + ' is not in ' + filestr)
+    tidx = [entry['time_index'][e] for e in fc_dates]
+    if varname is None:
+        varname = 'Hs'
+    if isinstance(varname,str):
+        varlst = [varname]
+    else:
+        varlst = list(varname)
+    fields, model_lats, model_lons = read_fields(entry,model,varlst,
+                                                 tidx,bbox=bbox)
+    for name in fields:
+        # time is first, drop singleton dimensions other than time
+        shape = fields[name].shape
+        fields[name] = fields[name].reshape(
+                        (len(tidx),) + tuple([e for e in shape[1:]
+                                              if e != 1]))
+    if isinstance(varname,str):
+        model_Hs = fields[varname]
+    else:
+        model_Hs = fields
+    return model_Hs, model_lats, model_lons, \
+           [entry['time'][i] for i in tidx], \
+           [entry['time_dt'][i] for i in tidx]
+
 def get_model(simmode=None,model=None,sdate=None,edate=None,
     fc_date=None,init_date=None,leadtime=None,expname=None,
-    sa_obj=None,timewin=None,varname=None):
+    sa_obj=None,timewin=None,varname=None,bbox=None,distlim=None):
     """ 
     Get model data.
+    for a list of varnames model_Hs is a dict of fields by name
+    the grid is restricted to bbox or, if distlim is given, to the
+    bounding box of the satellite tracks in sa_obj plus distlim
+    returned arrays are copies which may be modified by the caller
     """
     if sa_obj is not None:
         sdate = sa_obj.sdate
         edate = sa_obj.edate
+        if (bbox is None and distlim is not None):
+            from regionmod import track_bbox
+            bbox = track_bbox(sa_obj.loc[0],sa_obj.loc[1],
+                              distlim=distlim)
     if timewin is None:
         timewin = int(30)
     if (simmode == 'fc'):
@@ -184,7 +391,7 @@ def get_model(simmode=None,model=None,sdate=None,edate=None,
             model_time_dt = \
             get_model_fc_mode(filestr=element,model=model,
                     fc_date=fc_date,init_date=init_date,
-                    leadtime=leadtime,varname=varname)
+                    leadtime=leadtime,varname=varname,bbox=bbox)
             model_Hs_lst, \
             model_time_lst, \
             model_time_dt_lst = [],[],[]
@@ -192,6 +399,11 @@ def get_model(simmode=None,model=None,sdate=None,edate=None,
                 model_Hs_lst.append(model_Hs)
                 model_time_lst.append(model_time[i])
                 model_time_dt_lst.append(model_time_dt[i])
-        model_Hs = np.array(model_Hs_lst)
-    return model_Hs, model_lats, model_lons, model_time_lst, \
-           model_time_dt_lst
+        if isinstance(model_Hs,dict):
+            model_Hs = dict((name,np.array([e[name] for e in model_Hs_lst]))
+                            for name in model_Hs)
+        else:
+            model_Hs = np.array(model_Hs_lst)
+    # the grid of the file cache is read-only
+    return model_Hs, np.array(model_lats), np.array(model_lons), \
+           model_time_lst, model_time_dt_lst
@@ -310,6 +310,43 @@ def dumptonc_ts(outpath,filename,title,basetime,results_dict):
         ncdists.long_name = 'distances between observations and model grids'
         ncdists.units = 'km'
         ncdists[:] = dists
+    # further model parameters collocated along with Hs
+    startidx = len(nc['time']) - len(time)
+    for key in results_dict:
+        name = key[len('model_'):-len('_matches')]
+        if (not (key.startswith('model_') and key.endswith('_matches'))
+        or name in ['Hs','lons','lats']):
+            continue
+        if 'm' + name not in nc.variables:
+            ncvar = nc.createVariable('m' + name, np.float64,
+                                      dimensions=('time'))
+            ncvar.standard_name = 'model ' + name
+            if name in var_dict:
+                ncvar.long_name = var_dict[name]['standard_name']
+                ncvar.units = var_dict[name]['units']
+        nc.variables['m' + name][startidx:startidx+len(time)] = \
+            results_dict[key][:]
+    # footprint statistics of super-observations
+    sat_stats_dict = {
+        'count':{'long_name':'number of footprints per observation',
+                 'units':'1'},
+        'Hs_std':{'long_name':'standard deviation of significant wave '
+                              + 'height of footprints per observation',
+                  'units':'m'}}
+    for key in results_dict:
+        name = key[len('sat_'):-len('_matches')]
+        if (not (key.startswith('sat_') and key.endswith('_matches'))
+        or name in ['Hs','lons','lats']):
+            continue
+        if name not in nc.variables:
+            ncvar = nc.createVariable(name, np.float64,
+                                      dimensions=('time'))
+            ncvar.standard_name = 'obs ' + name
+            if name in sat_stats_dict:
+                ncvar.long_name = sat_stats_dict[name]['long_name']
+                ncvar.units = sat_stats_dict[name]['units']
+        nc.variables[name][startidx:startidx+len(time)] = \
+            results_dict[key][:]
     nc.close()
 
 def dumptonc_stats(outpath,filename,title,basetime,time_dt,valid_dict):
@@ -9,3 +9,16 @@ satpath_ftp_014_001 = ('/Core/'
                     + 'WAVE_GLO_WAV_L3_SWH_NRT_OBSERVATIONS_014_001/'
                     + 'dataset-wav-alti-l3-swh-rt-global-'
                     )
+
+# cache of pre-decoded satellite footprints, set to None to disable
+cachepath = '/home/vietadm/wavyMini/data/cache/'
+# disk budget of cache in bytes
+cachebudget = 5*1024**3
+
+# open model files and their grid and time metadata kept in memory
+modelcache_entries = 16
+# memory budget of model file metadata in bytes
+modelcache_bytes = 512*1024**2
+
+# catalogs of model output
+catalogpath = '/home/vietadm/wavyMini/data/catalogs/'
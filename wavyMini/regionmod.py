@@ -0,0 +1,244 @@
+"""
+- Module that takes care of the regions defined in region_specs
+- Vectorized masks for rectangular regions, polar caps and polygons
+"""
+import numpy as np
+from region_specs import region_dict, poly_dict
+
+def get_region_bounds(region):
+    """
+    returns dict of bounds for region name or
+    [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon]
+    """
+    if isinstance(region,str):
+        return region_dict[region]
+    return {"llcrnrlat":region[0],
+            "urcrnrlat":region[1],
+            "llcrnrlon":region[2],
+            "urcrnrlon":region[3]}
+
+def lon_mask(lons,llcrnrlon,urcrnrlon):
+    """
+    mask for longitudes within [llcrnrlon,urcrnrlon] independent of
+    the longitude convention, boxes with llcrnrlon>urcrnrlon
+    cross the dateline
+    """
+    width = urcrnrlon - llcrnrlon
+    if width < 0:
+        width = width + 360.
+    if width >= 360.:
+        return np.ones(np.shape(lons),dtype=bool)
+    return ((np.asarray(lons) - llcrnrlon) % 360.) <= width
+
+def region_mask(lats,lons,region):
+    """
+    boolean mask of footprints within region
+    region -> name in region_dict or [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon]
+    polar caps are defined by boundinglat, negative values
+    define caps around the south pole
+    """
+    lats = np.asarray(lats)
+    lons = np.asarray(lons)
+    if (region is None or region == 'Global'):
+        return np.ones(lats.shape,dtype=bool)
+    bounds = get_region_bounds(region)
+    if 'boundinglat' in bounds:
+        if bounds['boundinglat'] >= 0:
+            return lats >= bounds['boundinglat']
+        return lats <= bounds['boundinglat']
+    return ((lats >= bounds['llcrnrlat'])
+            & (lats <= bounds['urcrnrlat'])
+            & lon_mask(lons,bounds['llcrnrlon'],bounds['urcrnrlon']))
+
+def match_regions(lats,lons,regions,labels=None):
+    """
+    indices of footprints within any of the regions
+    and optionally the name of the first matching region
+    per footprint ('' for footprints outside all regions)
+    """
+    if labels is None:
+        labels = False
+    if (regions is None or isinstance(regions,str)
+    or not isinstance(regions[0],str)):
+        regions = [regions]
+    mask = np.zeros(np.shape(lats),dtype=bool)
+    if labels is True:
+        label = np.zeros(np.shape(lats),dtype=object)
+        label[:] = ''
+    for region in regions:
+        rmask = region_mask(lats,lons,region)
+        if labels is True:
+            label[rmask & ~mask] = str(region)
+        mask = mask | rmask
+    ridx = np.where(mask)[0]
+    if labels is True:
+        return ridx, label
+    return ridx
+
+def region_bbox(region):
+    """
+    returns [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon] enclosing
+    a region, None if the region does not constrain the domain,
+    boxes with llcrnrlon>urcrnrlon cross the dateline
+    """
+    if (region is None or region == 'Global'):
+        return None
+    if isinstance(region,str):
+        if region in region_dict:
+            bounds = region_dict[region]
+            if 'boundinglat' in bounds:
+                if bounds['boundinglat'] >= 0:
+                    return [bounds['boundinglat'],90.,-180.,180.]
+                return [-90.,bounds['boundinglat'],-180.,180.]
+            return [bounds['llcrnrlat'],bounds['urcrnrlat'],
+                    bounds['llcrnrlon'],bounds['urcrnrlon']]
+        if region in poly_dict:
+            return [min(poly_dict[region]['lats']),
+                    max(poly_dict[region]['lats']),
+                    min(poly_dict[region]['lons']),
+                    max(poly_dict[region]['lons'])]
+        return None
+    if isinstance(region,dict):
+        return [min(region['lats']),max(region['lats']),
+                min(region['lons']),max(region['lons'])]
+    if isinstance(region[0],str):
+        # several regions, dateline crossing boxes are not merged
+        bboxes = [region_bbox(e) for e in region]
+        if (None in bboxes or any([e[2] > e[3] for e in bboxes])):
+            return None
+        return [min([e[0] for e in bboxes]),max([e[1] for e in bboxes]),
+                min([e[2] for e in bboxes]),max([e[3] for e in bboxes])]
+    return list(region)
+
+def track_bbox(lats,lons,distlim=None):
+    """
+    returns [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon] enclosing all
+    footprints extended by distlim in km, None for empty tracks
+    """
+    lats = np.asarray(lats,dtype='float64')
+    lons = ((np.asarray(lons,dtype='float64') - 180) % 360) - 180
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    if not np.any(valid):
+        return None
+    if distlim is None:
+        distlim = 0
+    # about 111 km per degree latitude
+    dlat = distlim/111.
+    llcrnrlat = max(-90.,np.min(lats[valid]) - dlat)
+    urcrnrlat = min(90.,np.max(lats[valid]) + dlat)
+    coslat = np.cos(np.radians(max(abs(llcrnrlat),abs(urcrnrlat))))
+    if coslat < 1e-3:
+        return [llcrnrlat,urcrnrlat,-180.,180.]
+    dlon = dlat/coslat
+    return [llcrnrlat,urcrnrlat,
+            np.min(lons[valid]) - dlon, np.max(lons[valid]) + dlon]
+
+class prepared_polygon():
+    '''
+    polygon with path and bounding box prepared once,
+    point-in-polygon is only tested for points within the
+    bounding box
+    '''
+    def __init__(self,lats,lons):
+        from matplotlib.patches import Polygon
+        from matplotlib.path import Path
+        poly = Polygon(list(zip(lons,lats)), closed=True)
+        self.path = Path(poly.xy)
+        self.llcrnrlat, self.urcrnrlat = np.min(lats), np.max(lats)
+        self.llcrnrlon, self.urcrnrlon = np.min(lons), np.max(lons)
+
+    def contains(self,lats,lons):
+        lats = np.asarray(lats).ravel()
+        lons = np.asarray(lons).ravel()
+        mask = ((lats >= self.llcrnrlat) & (lats <= self.urcrnrlat)
+               & (lons >= self.llcrnrlon) & (lons <= self.urcrnrlon))
+        idx = np.where(mask)[0]
+        if len(idx) > 0:
+            mask[idx] = self.path.contains_points(np.c_[lons[idx],lats[idx]])
+        return mask
+
+# prepared regions are kept for the lifetime of the process
+poly_registry = {}
+model_domain_registry = {}
+
+def get_poly(region):
+    """
+    return prepared polygon for name in poly_dict or
+    dict with lats and lons
+    """
+    if isinstance(region,dict):
+        key = (tuple(region['lats']),tuple(region['lons']))
+        lats, lons = region['lats'], region['lons']
+    else:
+        key = region
+        lats, lons = poly_dict[region]['lats'], poly_dict[region]['lons']
+    if key not in poly_registry:
+        poly_registry[key] = prepared_polygon(lats,lons)
+    return poly_registry[key]
+
+def poly_mask(lats,lons,region):
+    """
+    boolean mask of footprints within polygon
+    """
+    return get_poly(region).contains(lats,lons)
+
+def get_model_domain(model):
+    """
+    return projection and extent of model domain in projected
+    coordinates, model grids are read only once per process
+    """
+    from datetime import datetime
+    from model_specs import model_dict
+    if model not in model_domain_registry:
+        from modelmod import get_model
+        import pyproj
+        if model == 'mwam8':
+            grid_date = datetime(2019,2,1,6)
+        elif model == 'ww3':
+            grid_date = datetime(2018,12,27,12)
+        elif (model == 'MoskNC' or model == 'MoskWC'):
+            grid_date = datetime(2018,3,1)
+        elif (model == 'swanKC'):
+            grid_date = datetime(2007,2,1)
+        elif (model == 'swan_karmoy250'):
+            grid_date = datetime(2018,1,1)
+        elif (model == 'ARCMFC3'):
+            grid_date = datetime(2019,7,3)
+        else:
+            grid_date = datetime(2019,2,1)
+        if (model == 'ARCMFC' or model=='ARCMFC3'):
+            model_Hs,model_lats,model_lons,model_time,model_time_dt = \
+                get_model(simmode="fc", model=model, fc_date=grid_date,
+                init_date=grid_date)
+        else:
+            model_Hs,model_lats,model_lons,model_time,model_time_dt = \
+                get_model(simmode="fc", model=model, fc_date=grid_date,
+                init_date=grid_date, leadtime=0)
+        if (len(np.shape(model_lats))==1 and len(np.shape(model_lons))==1):
+            model_lons, model_lats = np.meshgrid(model_lons, model_lats)
+        proj4 = model_dict[model]['proj4']
+        if proj4 is None:
+            proj_model = None
+            Mx, My = model_lons, model_lats
+        else:
+            proj_model = pyproj.Proj(proj4)
+            Mx, My = proj_model(model_lons,model_lats,inverse=False)
+        model_domain_registry[model] = {'proj':proj_model,
+                                        'xmin':np.min(Mx),
+                                        'xmax':np.max(Mx),
+                                        'ymin':np.min(My),
+                                        'ymax':np.max(My)}
+    return model_domain_registry[model]
+
+def model_domain_mask(lats,lons,model):
+    """
+    boolean mask of footprints within the extent of a model domain
+    """
+    domain = get_model_domain(model)
+    if domain['proj'] is None:
+        Vx, Vy = np.asarray(lons), np.asarray(lats)
+    else:
+        Vx, Vy = domain['proj'](np.asarray(lons),np.asarray(lats),
+                                inverse=False)
+    return ((Vx>domain['xmin']) & (Vx<domain['xmax']) &
+            (Vy>domain['ymin']) & (Vy<domain['ymax']))
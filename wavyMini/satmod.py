@@ -21,13 +21,7 @@ from argparse import RawTextHelpFormatter
 import os
 
 # get_altim
-if sys.version_info <= (3, 0):
-    from urllib import urlretrieve, urlcleanup # python2
-else:
-    from urllib.request import urlretrieve, urlcleanup # python3
-import gzip
-import ftplib
-from ftplib import FTP
+from ftpmod import ftp_session, download_files
 
 # read_altim
 import netCDF4 as netCDF4
@@ -38,6 +32,8 @@ import calendar
 # libraries for parallel computing
 from joblib import Parallel, delayed
 import multiprocessing as mp
+import threading
+import queue
 
 # bintime
 import math
@@ -53,6 +49,9 @@ import pathfinder
 
 # region spec
 from region_specs import poly_dict, region_dict
+
+# matchtime
+from utils import timewin_idx, seconds_to_dtime, runmean
 # --- global functions ------------------------------------------------#
 
 def progress(count, total, status=''):
@@ -116,49 +115,95 @@ def get_credentials():
         except:
             print("Credentials could not be obtained")
 
-def tmploop_get_remotefiles(i,matching,user,pw,
-                            server,path,destination):
-    #for element in matching:
-    print("File: ",matching[i])
-    dlstr=('ftp://' + user + ':' + pw + '@' 
-                + server + path + matching[i])
-    for attempt in range(10):
-        print("destination: " + destination)
-        try:
-            print ("Downloading file")
-            urlretrieve(dlstr, destination + matching[i])
-            urlcleanup()
-        except Exception as e:
-            print (e.__doc__)
-            print (e.message)
-            print ("Waiting for 10 sec and retry")
-            time.sleep(10)
-        else:
-            break
-    else:
-        print ('An error was raised and I ' + 
-              'failed to fix the problem myself :(')
-        print ('Exit program')
-        sys.exit()
+def get_filedates(filelst):
+    '''
+    parse first and last time stamp from file names, in hours
+    since 2000-01-01, nan if the name does not follow the convention
+    '''
+    import re
+    pattern = re.compile(r'_(\d{8}T\d{2})\d{4}_(\d{8}T\d{2})\d{4}')
+    basetime = datetime(2000,1,1)
+    sdates = np.zeros(len(filelst))*np.nan
+    edates = np.zeros(len(filelst))*np.nan
+    for i in range(len(filelst)):
+        match = pattern.search(filelst[i])
+        if match is not None:
+            sdates[i] = (datetime.strptime(match.group(1),'%Y%m%dT%H')
+                        - basetime).total_seconds()/3600.
+            edates[i] = (datetime.strptime(match.group(2),'%Y%m%dT%H')
+                        - basetime).total_seconds()/3600.
+    return sdates, edates
+
+def get_day(seconds):
+    '''
+    day of a time stamp in seconds since 2000-01-01
+    '''
+    date = datetime(2000,1,1) + timedelta(seconds=float(seconds))
+    return datetime(date.year,date.month,date.day)
+
+def get_remotelisting(session,path,tmpdate,catalog=None):
+    '''
+    list of (name,size,modify,fetched) of remote directory,
+    listings of months completed at the time of listing are
+    taken from the catalog
+    '''
+    if catalog is not None:
+        listed, content = catalog.get_remote_listing(path)
+        monthend = (datetime(tmpdate.year,tmpdate.month,1)
+                   + relativedelta(months=+1) + timedelta(days=1))
+        if (listed is not None
+        and listed > (monthend - datetime(1970,1,1)).total_seconds()):
+            print ('Using cached listing of ' + path)
+            return content
+    content = session.listdir(path)
+    if catalog is not None:
+        catalog.set_remote_listing(path,content,time.time())
+        listed, content = catalog.get_remote_listing(path)
+        return content
+    return [e + (None,) for e in content]
 
 def get_remotefiles(satpath,destination,sdate,edate,timewin,
-                    corenum,download):
+                    corenum,download,sync=None,ingest=None):
     '''
     Download swath files and store them at defined location
     time stamps in file name stand for: from, to, creation
+    sync -> only fetch files which are new or changed remotely
+    ingest -> decode files while downloading and store daily
+              blocks in the footprint cache
     '''
+    from catalogmod import sat_catalog, get_localpath
     if download is None:
         print ("No download initialized, checking local files")
         return
+    if sync is None:
+        sync = False
+    if ingest is None:
+        ingest = False
     # credentials
     user, pw = get_credentials()
+    server='nrt.cmems-du.eu'
+    session = ftp_session(server,user,pw)
+    catalog = sat_catalog(destination)
+    if ingest is True:
+        # destination is organized as downloadpath/sat/
+        pipeline = ingest_pipeline(
+                        os.path.basename(os.path.normpath(destination)),
+                        catalog,corenum=corenum)
+        def callback(target):
+            if catalog.register(target):
+                pipeline.submit(target)
+    else:
+        callback = catalog.register
+    # hours covered by time window
+    basetime = datetime(2000,1,1)
+    hstart = np.floor(((sdate-timedelta(minutes=timewin)) - basetime)
+                    .total_seconds()/3600.)
+    hend = np.floor(((edate+timedelta(minutes=timewin)) - basetime)
+                    .total_seconds()/3600.)
     tmpdate = deepcopy(sdate)
-    pathlst = []
-    filelst = []
     while (tmpdate <= edate):
         # server and path
         if sdate >= datetime(2017,7,9):
-            server='nrt.cmems-du.eu'
             path=(satpath
                  + '/'
                  + str(tmpdate.year)
@@ -172,49 +217,49 @@ def get_remotefiles(satpath,destination,sdate,edate,timewin,
         else:
             sys.exit("Product not available for chosen date!")
         # get list of accessable files
-        ftp = FTP(server)
-        ftp.login(user, pw)
-        ftp.cwd(path)
-        content=FTP.nlst(ftp)
+        if sync is True:
+            content = get_remotelisting(session,path,tmpdate,
+                                        catalog=catalog)
+        else:
+            content = get_remotelisting(session,path,tmpdate)
         #choose files according to verification date
-        tmplst=[]
-        tmpdate_new=tmpdate-timedelta(minutes=timewin)
-        tmpend=edate+timedelta(minutes=timewin)
-        while (tmpdate_new.strftime("%Y%m%dT%H")
-            <= tmpend.strftime("%Y%m%dT%H")):
-            matchingtmp = [s for s in content
-                            if ('_'
-                            + str(tmpdate_new.year)
-                            + str(tmpdate_new)[5:7]
-                            + str(tmpdate_new)[8:10]
-                            + 'T'
-                            + str(tmpdate_new)[11:13])
-                            in s
-                            ]
-            tmplst = tmplst + matchingtmp
-            tmpdate_new = tmpdate_new + timedelta(minutes=timewin)
-        matching = tmplst
+        sdates, edates = get_filedates([e[0] for e in content])
+        with np.errstate(invalid='ignore'):
+            hits = (sdates <= hend) & (edates >= hstart)
+        content = [content[i] for i in np.where(hits)[0]]
+        if sync is True:
+            # compare with local catalog
+            catalog.update(datetime(tmpdate.year,tmpdate.month,1),tmpdate)
+            local_sizes = catalog.get_local_sizes([e[0] for e in content])
+            content = [e for e in content
+                        if (local_sizes.get(e[0]) != e[1]
+                        or (e[3] is not None and e[3] != e[2]))]
+        matching = [e[0] for e in content]
         print ("Download initiated")
-        # Download and gunzip matching files
+        # Download matching files
         print ('Downloading ' + str(len(matching)) + ' files: .... \n')
         print ("Used number of cores " + str(corenum) + "!")
-        os.system("mkdir -p " + destination)
-        Parallel(n_jobs=corenum)(
-                        delayed(tmploop_get_remotefiles)(
-                        i,matching,user,pw,server,
-                        path,destination
-                        ) for i in range(len(matching))
-                        )
+        targetlst = [get_localpath(destination,e) for e in matching]
+        if ingest is True:
+            if sync is False:
+                catalog.update(datetime(tmpdate.year,tmpdate.month,1),
+                               tmpdate)
+            pipeline.expect(targetlst)
+        # files are placed in destination/year/month and
+        # registered in the catalog as soon as they are complete
+        downloaded, failed = download_files(matching,server,path,
+                                destination,user,pw,corenum=corenum,
+                                targetlst=targetlst,callback=callback)
+        if sync is True:
+            catalog.set_fetched(path,[os.path.basename(e)
+                                      for e in downloaded])
         # update time
         tmpdate = datetime((tmpdate + relativedelta(months=+1)).year,(tmpdate + relativedelta(months=+1)).month,1)
+    session.close()
+    if ingest is True:
+        pipeline.close()
+    catalog.close()
     print ('Files downloaded to: \n' + destination)
-    print('Organizing downloaded files in year and month')
-    from os.path import expanduser
-    home = expanduser("~")
-    os.system('cd ' + destination 
-            + ' && python '
-            + home
-            + '/wavyMini/wavyMini/sort.py')
 
 # flatten all lists before returning them
 # define flatten function for lists
@@ -241,6 +286,214 @@ def check_date(filelst,date):
             idx.append(i)
     return idx[0],idx[-1]
 
+def read_swath(pathtofile):
+    '''
+    read one swath file, returns dict of float arrays with masked
+    values set to nan, None if the file cannot be read
+    '''
+    try:
+        # file includes a 1-D dataset with dimension time
+        f = netCDF4.Dataset(pathtofile,'r')
+        swath = {}
+        for name in ['time','latitude','longitude','VAVH']:
+            swath[name] = np.ma.filled(
+                            np.ma.array(f.variables[name][:],
+                                        dtype='float64'),
+                            np.nan)
+        f.close()
+    except (IOError,OSError):
+        print ("No such file or directory")
+        return None
+    # transform
+    swath['longitude'] = ((swath['longitude'] - 180) % 360) - 180
+    return swath
+
+def concat_swaths(swaths):
+    '''
+    concatenate swaths to one timeseries for each variable with
+    unique time steps and smoothed Hs
+    '''
+    swaths = [e for e in swaths if e is not None]
+    # preallocate contiguous arrays and fill in file order
+    length = sum([len(e['time']) for e in swaths])
+    fLATS = np.empty(length,dtype='float64')
+    fLONS = np.empty(length,dtype='float64')
+    fTIME = np.empty(length,dtype='float64')
+    fVAVHS = np.empty(length,dtype='float64')
+    fMAXS = []
+    start = 0
+    for swath in swaths:
+        end = start + len(swath['time'])
+        fLATS[start:end] = swath['latitude']
+        fLONS[start:end] = swath['longitude']
+        fTIME[start:end] = swath['time']
+        fVAVHS[start:end] = swath['VAVH']
+        fMAXS.append(np.nanmax(swath['VAVH']))
+        start = end
+    print ('\n')
+    fTIME,indices=np.unique(fTIME,return_index=True)
+    fLATS=fLATS[indices]
+    fLONS=fLONS[indices]
+    fVAVHS=fVAVHS[indices]
+    # smooth Hs time series
+    fVAVHS_smooth,fVAVHS_std = runmean(fVAVHS,5,'centered')
+    return fLATS, fLONS, fTIME, fVAVHS, fMAXS, fVAVHS_smooth
+
+class ingest_pipeline():
+    '''
+    class to decode swath files while they are downloaded
+    Completed downloads are handed over a bounded queue to a pool of
+    decoder processes. Files belong to the day of their first time
+    stamp as in the catalog. As soon as no announced file may start
+    on a day, the daily block of all catalogued files of this day is
+    written to the footprint cache.
+    '''
+    def __init__(self,sat,catalog,corenum=None,maxqueue=None):
+        from cachemod import footprint_cache
+        if corenum is None:
+            corenum = 1
+        if maxqueue is None:
+            maxqueue = 2*corenum
+        self.sat = sat
+        self.catalog = catalog
+        self.cache = footprint_cache()
+        self.pool = mp.Pool(corenum)
+        self.slots = threading.BoundedSemaphore(maxqueue)
+        self.results = queue.Queue()
+        self.announced = {} # path -> day of file name, not yet submitted
+        self.running = {} # path -> estimated day, decoding
+        self.swaths = {} # path -> decoded swath, until written
+        self.failed = set() # paths of files without valid data
+        self.days = {} # day -> paths of decoded files starting on day
+        self.closing = False
+        self.lock = threading.Lock()
+        self.writer = threading.Thread(target=self.collect)
+        self.writer.start()
+
+    def expect(self,pathlst):
+        '''
+        announce files to be downloaded, their days are estimated
+        from the file names until they are decoded
+        '''
+        basetime = datetime(2000,1,1)
+        hours = get_filedates([os.path.basename(e) for e in pathlst])[0]
+        with self.lock:
+            for pathtofile, hour in zip(pathlst,hours):
+                if np.isnan(hour):
+                    day = None
+                else:
+                    day = get_day(hour*60*60)
+                self.announced[os.path.normpath(pathtofile)] = day
+
+    def submit(self,pathtofile,day=None,bounded=True):
+        '''
+        queue file for decoding, blocks while the queue is full
+        unless bounded is False
+        '''
+        pathtofile = os.path.normpath(pathtofile)
+        with self.lock:
+            estimate = self.announced.pop(pathtofile,None)
+            self.running[pathtofile] = day if day is not None else estimate
+        if bounded:
+            self.slots.acquire()
+        self.pool.apply_async(read_swath,(pathtofile,),
+            callback=lambda swath: self.results.put(
+                                        (pathtofile,swath,bounded)),
+            error_callback=lambda e: self.results.put(
+                                        (pathtofile,None,bounded)))
+
+    def pending(self,day):
+        '''
+        True if an announced or running file may start on day,
+        called with the lock held
+        '''
+        for estimate in (list(self.announced.values())
+                        + list(self.running.values())):
+            if (estimate is None
+            or abs((estimate - day).total_seconds()) <= 24*60*60):
+                return True
+        return False
+
+    def collect(self):
+        '''
+        receive decoded swaths and write completed days
+        '''
+        while True:
+            item = self.results.get()
+            if item is not None:
+                pathtofile, swath, bounded = item
+                if bounded:
+                    self.slots.release()
+                with self.lock:
+                    self.running.pop(pathtofile,None)
+                    if (swath is not None
+                    and np.any(np.isfinite(swath['time']))):
+                        day = get_day(np.nanmin(swath['time']))
+                        self.swaths[pathtofile] = swath
+                        self.days.setdefault(day,set()).add(pathtofile)
+                    else:
+                        self.failed.add(pathtofile)
+            with self.lock:
+                ready = [day for day in self.days if not self.pending(day)]
+            for day in ready:
+                self.write(day)
+            with self.lock:
+                if (self.closing and len(self.running) == 0
+                and len(self.days) == 0):
+                    break
+
+    def write(self,day):
+        '''
+        store block of all valid files of a day in the cache, files
+        of the day in the catalog not decoded yet (or written with an
+        earlier block of the day) are submitted first
+        '''
+        with self.catalog.lock:
+            filelst = self.catalog.query_day(day)
+        with self.lock:
+            missing = [e[0] for e in filelst
+                       if (e[0] not in self.swaths
+                       and e[0] not in self.running
+                       and e[0] not in self.failed)]
+            if any([e[0] in self.running for e in filelst]):
+                return
+        if len(missing) > 0:
+            for pathtofile in missing:
+                self.submit(pathtofile,day=day,bounded=False)
+            return
+        with self.lock:
+            paths = self.days.pop(day) | set([e[0] for e in filelst])
+            swaths = dict([(e,self.swaths.pop(e)) for e in paths
+                           if e in self.swaths])
+        valid = sorted([(np.nanmin(swaths[e[0]]['time']),e[0])
+                        for e in filelst if e[0] in swaths])
+        if len(valid) == 0:
+            return
+        fLATS,fLONS,fTIME,fVAVHS,fMAXS,fVAVHS_smooth = \
+            concat_swaths([swaths[e[1]] for e in valid])
+        # keyed by the catalog entries of the day as in read_cachedfiles
+        self.cache.put(self.sat,day,filelst,
+                       {'time':fTIME,
+                        'latitude':fLATS,
+                        'longitude':fLONS,
+                        'VAVH':fVAVHS,
+                        'VAVH_smooth':fVAVHS_smooth})
+        print ("Cache built for " + self.sat + " "
+                + day.strftime('%Y-%m-%d'))
+
+    def close(self):
+        '''
+        wait for all decoders, days with failed downloads are
+        written with the files available
+        '''
+        with self.lock:
+            self.announced = {}
+            self.closing = True
+        self.results.put(None)
+        self.writer.join()
+        self.pool.close()
+        self.pool.join()
+
 # ---------------------------------------------------------------------#
 
 
@@ -258,7 +511,8 @@ class satellite_altimeter():
     from region_specs import region_dict
 
     def __init__(self,sdate,sat=None,edate=None,timewin=None,download=None,
-        region=None,corenum=None,mode=None,polyreg=None,destination=None):
+        region=None,corenum=None,mode=None,polyreg=None,destination=None,
+        cache=None,sync=None):
         if sat is None:
             sat = 's3a'
         print ('# ----- ')
@@ -267,6 +521,8 @@ class satellite_altimeter():
         print ('# ----- ')
         if corenum is None:
             corenum = 1
+        if cache is None:
+            cache = False
         if edate is None:
             print ("Requested time: ", str(sdate))
             edate = sdate
@@ -284,130 +540,153 @@ class satellite_altimeter():
                             +  sat + '/'
                             )
         self.destination = destination
+        self.corenum = corenum
         # retrieve files
         os.system("mkdir -p " + destination)
         get_remotefiles(satpath_ftp_014_001,destination,
-                        sdate,edate,timewin,corenum,download)
-        pathlst, filelst = self.get_localfilelst(
-                                sdate,edate,timewin,region
-                                )
-        fLATS,fLONS,fTIME,fVAVHS,fMAXS,fVAVHS_smooth = \
+                        sdate,edate,timewin,corenum,download,sync=sync)
+        if cache:
+            fLATS,fLONS,fTIME,fVAVHS,fMAXS,fVAVHS_smooth = \
+                                    self.read_cachedfiles(
+                                        sat,sdate,edate,timewin
+                                        )
+        else:
+            pathlst, filelst = self.get_localfilelst(
+                                    sdate,edate,timewin,region,
+                                    polyreg=polyreg
+                                    )
+            fLATS,fLONS,fTIME,fVAVHS,fMAXS,fVAVHS_smooth = \
                                     self.read_localfiles(pathlst)
-        idx = np.array(range(len(fVAVHS)))[~np.isnan(fVAVHS)]
-        fLATS = list(np.array(fLATS)[idx])
-        fLONS = list(np.array(fLONS)[idx])
-        fTIME = list(np.array(fTIME)[idx])
-        fVAVHS = list(np.array(fVAVHS)[idx])
-        fVAVHS_smooth = list(np.array(fVAVHS_smooth)[idx])
-        gloc = [fLATS,fLONS]
-        gHs = fVAVHS
-        gHs_smooth = fVAVHS_smooth
-        # find values for give time constraint
-        ctime,cidx,timelst = self.matchtime(sdate,edate,fTIME,timewin)
-        cloc = [np.array(fLATS)[cidx],np.array(fLONS)[cidx]]
-        cHs = list(np.array(gHs)[cidx])
-        cHs_smooth = list(np.array(gHs_smooth)[cidx])
-        cTIME = list(np.array(fTIME)[cidx])
+        self.basetime = datetime(2000,1,1)
+        # find values for given time constraint, a view on sorted time
+        tidx = timewin_idx(fTIME,sdate,edate,timewin=timewin,
+                           basetime=self.basetime)
+        cidx = np.arange(len(fTIME))[tidx]
+        cidx = cidx[~np.isnan(fVAVHS[tidx])]
         # find values for given region
         latlst,lonlst,rlatlst,rlonlst,ridx,region = \
-            self.matchregion(cloc[0],cloc[1],region=region,\
+            self.matchregion(fLATS[cidx],fLONS[cidx],region=region,\
             polyreg=polyreg)
-        rloc = [cloc[0][ridx],cloc[1][ridx]]
-        rHs = list(np.array(cHs)[ridx])
-        rHs_smooth = list(np.array(cHs_smooth)[ridx])
-        rtime = list(np.array(ctime)[ridx])
-        rTIME = list(np.array(cTIME)[ridx])
+        # one copy per field for combined time and region constraint
+        ridx = cidx[np.asarray(ridx,dtype=int)]
         self.edate = edate
         self.sdate = sdate
-        self.basetime = datetime(2000,1,1)
-        self.loc = rloc # regional coords [lats,lons]
-        self.Hs = rHs # regional HS
-        self.Hs_smooth = rHs_smooth # region smoothed ts
-        self.idx = ridx # region indices
-        self.dtime = rtime # region time steps as datetime obj
-        self.time = rTIME # region time steps in seconds from basedate
+        self.loc = [fLATS[ridx],fLONS[ridx]] # regional coords [lats,lons]
+        self.Hs = fVAVHS[ridx] # regional HS
+        self.Hs_smooth = fVAVHS_smooth[ridx] # region smoothed ts
+        self.idx = ridx # indices of all read values
+        self.time = fTIME[ridx] # region time steps in seconds from basedate
+        self._dtime = None # region time steps as datetime obj
         self.timewin = timewin
         self.region = region
         self.sat = sat
         print ("Satellite object initialized including " 
                 + str(len(self.Hs)) + " footprints.")
 
-    def get_localfilelst(self,sdate,edate,timewin,region):
+    @property
+    def dtime(self):
+        '''
+        region time steps as datetime obj built on first access
+        '''
+        if self._dtime is None:
+            self._dtime = seconds_to_dtime(self.time,self.basetime)
+        return self._dtime
+
+    @dtime.setter
+    def dtime(self,dtime):
+        self._dtime = dtime
+
+    def get_localfilelst(self,sdate,edate,timewin,region,polyreg=None):
+        '''
+        select files for the time window and region from the catalog
+        of local files, the catalog is updated beforehand
+        '''
+        from catalogmod import sat_catalog
         print ("Time window: ", timewin)
-        tmpdate=deepcopy(sdate-timedelta(minutes=timewin))
-        pathlst = []
-        filelst = []
-        while (tmpdate <= edate + timedelta(minutes=timewin)):
-            tmpdatestr=(self.destination
-                        + str(tmpdate.year)
-                        + '/' + tmpdate.strftime('%m')
-                        + '/')
-            tmplst = np.sort(os.listdir(tmpdatestr))
-            filelst.append(tmplst)
-            #pathlst = [(tmpdatestr + e) for e in tmplst]
-            pathlst.append([(tmpdatestr + e) for e in tmplst])
-            if (edate is not None and edate!=sdate):
-                tmpdate = tmpdate + timedelta(hours=1)
-            else:
-                tmpdate = tmpdate + relativedelta(months=+1)
-        filelst=np.sort(flatten(filelst))
-        pathlst=np.sort(flatten(pathlst))
-        idx_start,tmp = check_date(pathlst,sdate-timedelta(minutes=timewin))
-        tmp,idx_end = check_date(pathlst,edate+timedelta(minutes=timewin))
-        del tmp
-        pathlst = np.unique(pathlst[idx_start:idx_end+1])
-        filelst = np.unique(filelst[idx_start:idx_end+1])
+        sdate_win = sdate-timedelta(minutes=timewin)
+        edate_win = edate+timedelta(minutes=timewin)
+        catalog = sat_catalog(self.destination)
+        # files are sorted by start date, look back one day for files
+        # that start before sdate
+        catalog.update(sdate_win-timedelta(days=1),edate_win)
+        if polyreg is not None:
+            region = polyreg
+        pathlst = np.array(catalog.query(sdate_win,edate_win,
+                                         region=region))
+        catalog.close()
+        filelst = np.array([os.path.basename(e) for e in pathlst])
         print (str(int(len(pathlst))) + " valid files found")
         return pathlst,filelst
 
-    def read_localfiles(self,pathlst):
+    def read_localfiles(self,pathlst,corenum=None):
         '''
         read and concatenate all data to one timeseries for each variable
+        files are read in parallel using corenum workers
         '''
-        from utils import runmean
-        # --- open file and read variables --- #
-        LATS = []
-        LONS = []
-        VAVHS = []
-        TIME = []
-        MAXS = []
-        count = 0
+        if corenum is None:
+            corenum = self.corenum
         print ("Processing " + str(int(len(pathlst))) + " files")
-        print (pathlst[0])
-        print (pathlst[-1])
-        for element in pathlst:
-            progress(count,str(int(len(pathlst))),'')
-            try:
-                # file includes a 1-D dataset with dimension time
-                f = netCDF4.Dataset(element,'r')
-                tmp = f.variables['longitude'][:]
-                # transform
-                lons = ((tmp - 180) % 360) - 180
-                lats = f.variables['latitude'][:]
-                time = f.variables['time'][:]
-                VAVH = f.variables['VAVH'][:]
-                f.close()
-                LATS.append(lats)
-                LONS.append(lons)
-                TIME.append(time)
-                VAVHS.append(VAVH)
-                MAXS.append(np.max(VAVH.astype('float')))
-            except (IOError):
-                print ("No such file or directory")
-            count = count + 1
-        print ('\n')
-        # apply flatten to all lists
-        fTIME,fLATS,fLONS,fVAVHS,fMAXS=\
-            flatten(TIME),flatten(LATS),flatten(LONS),\
-            flatten(VAVHS),MAXS
-        fTIME_unique,indices=np.unique(fTIME,return_index=True)
-        fLATS=list(np.array(fLATS)[indices])
-        fLONS=list(np.array(fLONS)[indices])
-        fTIME=list(np.array(fTIME)[indices])
-        fVAVHS=list(np.array(fVAVHS)[indices])
-        # smooth Hs time series
-        fVAVHS_smooth,fVAVHS_std = runmean(fVAVHS,5,'centered')
-        return fLATS, fLONS, fTIME, fVAVHS, fMAXS, fVAVHS_smooth
+        if len(pathlst)>0:
+            print (pathlst[0])
+            print (pathlst[-1])
+        print ("Used number of cores " + str(corenum) + "!")
+        # --- open files and read variables --- #
+        swaths = Parallel(n_jobs=corenum)(
+                        delayed(read_swath)(element)
+                        for element in pathlst
+                        )
+        return concat_swaths(swaths)
+
+    def read_cachedfiles(self,sat,sdate,edate,timewin):
+        '''
+        read footprints of the time window from cleaned daily blocks
+        of the cache, missing or outdated blocks are built from all
+        local files of the day and stored for later reads
+        '''
+        from catalogmod import sat_catalog
+        from cachemod import footprint_cache, footprint_dtype
+        sdate_win = sdate-timedelta(minutes=timewin)
+        edate_win = edate+timedelta(minutes=timewin)
+        catalog = sat_catalog(self.destination)
+        # files are sorted by start date, look back one day for files
+        # that start before sdate
+        catalog.update(sdate_win-timedelta(days=1),edate_win)
+        cache = footprint_cache()
+        tmin = (sdate_win - datetime(2000,1,1)).total_seconds()
+        tmax = (edate_win - datetime(2000,1,1)).total_seconds()
+        blocks = []
+        tmpdate = (datetime(sdate_win.year,sdate_win.month,sdate_win.day)
+                  - timedelta(days=1))
+        while tmpdate <= edate_win:
+            filelst = catalog.query_day(tmpdate)
+            if len(filelst)>0:
+                block = cache.get(sat,tmpdate,filelst)
+                if block is None:
+                    print ("Building cache for " + sat + " "
+                            + tmpdate.strftime('%Y-%m-%d'))
+                    fLATS,fLONS,fTIME,fVAVHS,fMAXS,fVAVHS_smooth = \
+                        self.read_localfiles([e[0] for e in filelst])
+                    block = cache.put(sat,tmpdate,filelst,
+                                      {'time':fTIME,
+                                       'latitude':fLATS,
+                                       'longitude':fLONS,
+                                       'VAVH':fVAVHS,
+                                       'VAVH_smooth':fVAVHS_smooth})
+                # copy only the time window of the block
+                blocks.append(block[(block['time'] >= tmin)
+                                    & (block['time'] <= tmax)])
+            tmpdate = tmpdate + timedelta(days=1)
+        catalog.close()
+        print (str(int(len(blocks))) + " daily blocks found")
+        if len(blocks)>0:
+            block = np.concatenate(blocks)
+        else:
+            block = np.empty(0,dtype=footprint_dtype)
+        fMAXS = [np.nanmax(e['VAVH']) for e in blocks if len(e)>0]
+        fTIME,indices=np.unique(block['time'],return_index=True)
+        return block['latitude'][indices], block['longitude'][indices], \
+               fTIME, block['VAVH'][indices], fMAXS, \
+               block['VAVH_smooth'][indices]
 
     def bintime(self,binframe=None):
         '''
@@ -426,12 +705,12 @@ class satellite_altimeter():
         timewin = 0
         for i in range(trange):
             lodt=sdate+timedelta(days=dincr)
-            ctime,cidx,timelst = self.matchtime(
-                                    datetime(lodt.year,lodt.month,lodt.day),
-                                    datetime(lodt.year,lodt.month,lodt.day)
-                                    +timedelta(days=1),
-                                    listofdatetimes_sec,
-                                    timewin = timewin)
+            cidx = timewin_idx(listofdatetimes_sec,
+                               datetime(lodt.year,lodt.month,lodt.day),
+                               datetime(lodt.year,lodt.month,lodt.day)
+                               +timedelta(days=1),
+                               timewin = timewin,
+                               basetime = self.basetime)
             count=len(np.array(self.rHs)[
                                 cidx][
                                 ~np.isnan(np.array(self.rHs)[cidx])
@@ -448,37 +727,19 @@ class satellite_altimeter():
         requested time step from buoy and forecast including the 
         respective time stamp(s). Similarily, indices are chosen
         for the time and defined region.
+        timelst is returned as datetime64 array, ctime as list of
+        datetime objects for the matching time steps only
         '''
+        from utils import idx_array, seconds_to_datetime64
         if timewin is None:
             timewin = 0
         basetime=datetime(2000,1,1)
-        # create list of datetime instances
-        timelst=[]
-        ctime=[]
-        cidx=[]
-        idx=0
         print ('Time window is: ', timewin)
-        if (edate is None or sdate==edate):
-            for element in fTIME:
-                tmp=basetime + timedelta(seconds=element)
-                timelst.append(tmp)
-                # choose closest match within window of win[minutes]
-                if (tmp >= sdate-timedelta(minutes=timewin) 
-                and tmp < sdate+timedelta(minutes=timewin)):
-                    ctime.append(tmp)
-                    cidx.append(idx)
-                del tmp
-                idx=idx+1
-        if (edate is not None and edate!=sdate):
-            for element in fTIME:
-                tmp=basetime + timedelta(seconds=element)
-                timelst.append(tmp)
-                if (tmp >= sdate-timedelta(minutes=timewin)
-                and tmp < edate+timedelta(minutes=timewin)):
-                    ctime.append(tmp)
-                    cidx.append(idx)
-                del tmp
-                idx=idx+1
+        fTIME = np.asarray(fTIME,dtype='float64')
+        cidx = idx_array(timewin_idx(fTIME,sdate,edate,timewin=timewin,
+                                     basetime=basetime),len(fTIME))
+        ctime = seconds_to_dtime(fTIME[cidx],basetime)
+        timelst = seconds_to_datetime64(fTIME,basetime)
         return ctime, cidx, timelst
 
     def matchregion(self,LATS,LONS,region,polyreg):
@@ -486,9 +747,8 @@ class satellite_altimeter():
         if polyreg is None:
             if region is None:
                 region = 'Global'
-            if ~isinstance(region,str)==True:
-                print ("Manuall specified region "
-                    + [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon] + ": \n"
+            if isinstance(region,str)==False:
+                print ("Manually specified region(s): \n"
                     + " --> Bounds: " + str(region))
             else:
                 if region not in region_dict.keys():
@@ -505,130 +765,54 @@ class satellite_altimeter():
         return latlst, lonlst, rlatlst, rlonlst, ridx, region
 
     def matchregion_prim(self,LATS,LONS,region):
+        '''
+        region -> name in region_dict, list of names, or
+                  [llcrnrlat,urcrnrlat,llcrnrlon,urcrnrlon]
+        '''
+        from regionmod import match_regions
+        LATS = np.asarray(LATS)
+        LONS = np.asarray(LONS)
         if (region is None or region == "Global"):
-            region = "Global"
-            latlst = LATS
-            lonlst = LONS
-            rlatlst= LATS
-            rlonlst= LONS
-            ridx = range(len(LATS))
+            ridx = np.arange(len(LATS))
         else:
-            if isinstance(region,str)==True:
-                if (region=='ARCMFC' or region=='Arctic'):
-                    boundinglat = self.region_dict[region]["boundinglat"]
-                else:
-                    llcrnrlat = self.region_dict[region]["llcrnrlat"]
-                    urcrnrlat = self.region_dict[region]["urcrnrlat"]
-                    llcrnrlon = self.region_dict[region]["llcrnrlon"]
-                    urcrnrlon = self.region_dict[region]["urcrnrlon"]
-            else:
-                llcrnrlat = region[0]
-                urcrnrlat = region[1]
-                llcrnrlon = region[2]
-                urcrnrlon = region[3]
-            # check if coords in region
-            latlst=[]
-            lonlst=[]
-            rlatlst=[]
-            rlonlst=[]
-            ridx=[]
-            for i in range(len(LATS)):
-                latlst.append(LATS[i])
-                lonlst.append(LONS[i])
-                if (
-                (region=='ARCMFC' or region=='Arctic')
-                and LATS[i] >= boundinglat
-                    ):
-                    rlatlst.append(LATS[i])
-                    rlonlst.append(LONS[i])
-                    ridx.append(i)
-                elif(
-                region != 'ARCMFC' and region != 'Arctic'
-                and LATS[i] >= llcrnrlat
-                and LATS[i] <= urcrnrlat
-                and LONS[i] >= llcrnrlon
-                and LONS[i] <= urcrnrlon
-                    ):
-                    rlatlst.append(LATS[i])
-                    rlonlst.append(LONS[i])
-                    ridx.append(i)
-        if not ridx:
+            ridx = match_regions(LATS,LONS,region)
+        latlst = LATS
+        lonlst = LONS
+        rlatlst = LATS[ridx]
+        rlonlst = LONS[ridx]
+        if len(ridx)==0:
             print ("No values for chosen region and time frame!!!")
         else:
             print ("Values found for chosen region and time frame.")
         return latlst, lonlst, rlatlst, rlonlst, ridx
 
     def matchregion_poly(self,LATS,LONS,region):
-        from matplotlib.patches import Polygon
-        from matplotlib.path import Path
-        import numpy as np
+        '''
+        region -> name in poly_dict, model name for model domain,
+                  or dict with lats and lons of polygon
+        '''
+        from regionmod import poly_mask, model_domain_mask
         from model_specs import model_dict
-        if (region not in poly_dict.keys() \
-            and region not in model_dict.keys()):
-            sys.exit("Region is not defined")
-        elif isinstance(region,dict)==True:
+        LATS = np.asarray(LATS)
+        LONS = np.asarray(LONS)
+        if isinstance(region,dict)==True:
             print ("Manuall specified region: \n"
                 + " --> Bounds: " + str(region))
-            poly = Polygon(list(zip(region['lons'],
-                region['lats'])), closed=True)
-        elif (isinstance(region,str)==True and region in model_dict.keys()):
-            from modelmod import get_model
-            import pyproj
-            if region == 'mwam8':
-                grid_date = datetime(2019,2,1,6)
-            elif region == 'ww3':
-                grid_date = datetime(2018,12,27,12)
-            elif (region == 'MoskNC' or region == 'MoskWC'):
-                grid_date = datetime(2018,3,1)
-            elif (region == 'swanKC'):
-                grid_date = datetime(2007,2,1)
-            elif (region == 'swan_karmoy250'):
-                grid_date = datetime(2018,1,1)
-            elif (region == 'ARCMFC3'):
-                grid_date = datetime(2019,7,3)
-            else:
-                grid_date = datetime(2019,2,1)
-            if (region == 'ARCMFC' or region=='ARCMFC3'):
-                model_Hs,model_lats,model_lons,model_time,model_time_dt = \
-                    get_model(simmode="fc", model=region, fc_date=grid_date,
-                    init_date=grid_date)
-            else:
-                model_Hs,model_lats,model_lons,model_time,model_time_dt = \
-                    get_model(simmode="fc", model=region, fc_date=grid_date,
-                    leadtime=0)
-            if (region == 'swanKC' or region == 'swan_karmoy250'):
-                model_lats, model_lons = np.meshgrid(model_lats, model_lons)
-            proj4 = model_dict[region]['proj4']
-            proj_model = pyproj.Proj(proj4)
-            Mx, My = proj_model(model_lons,model_lats,inverse=False)
-            Vx, Vy = proj_model(LONS,LATS,inverse=False)
-            xmax, xmin = np.max(Mx), np.min(Mx)
-            ymax, ymin = np.max(My), np.min(My)
-            ridx = list(np.where((Vx>xmin) & (Vx<xmax) & 
-                                (Vy>ymin) & (Vy<ymax))[0]
-                        )
-            latlst, lonlst = LATS, LONS
-            rlatlst, rlonlst = LATS[ridx], LONS[ridx]
-        elif isinstance(region,str)==True:
+            hits = poly_mask(LATS,LONS,region)
+        elif region in model_dict.keys():
+            hits = model_domain_mask(LATS,LONS,region)
+        elif region in poly_dict.keys():
             print ("Specified region: " + region + "\n"
               + " --> Bounded by polygon: \n"
               + "lons: " + str(poly_dict[region]['lons']) + "\n"
               + "lats: " + str(poly_dict[region]['lats']))
-            poly = Polygon(list(zip(poly_dict[region]['lons'],
-                poly_dict[region]['lats'])), closed=True)
-            # check if coords in region
-            LATS = list(LATS)
-            LONS = list(LONS)
-            latlst = LATS
-            lonlst = LONS
-            lats = np.array(LATS).ravel()
-            lons = np.array(LONS).ravel()
-            points = np.c_[lons,lats]
-            hits = Path(poly.xy).contains_points(points)
-            rlatlst = list(np.array(LATS)[hits])
-            rlonlst = list(np.array(LONS)[hits])
-            ridx = list(np.array(range(len(LONS)))[hits])
-        if not ridx:
+            hits = poly_mask(LATS,LONS,region)
+        else:
+            sys.exit("Region is not defined")
+        ridx = np.where(hits)[0]
+        latlst, lonlst = LATS, LONS
+        rlatlst, rlonlst = LATS[ridx], LONS[ridx]
+        if len(ridx)==0:
             print ("No values for chosen region and time frame!!!")
         else:
             print ("Values found for chosen region and time frame.")
@@ -636,24 +820,20 @@ class satellite_altimeter():
 
 
 def get_pointsat(sa_obj,station=None,lat=None,lon=None,distlim=None):
-    from utils import haversine
+    from utils import haversine_point
     from stationlist import locations
     if ((lat is None or lon is None) and (station is None)):
         print ("location is missing")
     if (lat is None or lon is None):
         lat=locations[station][0]
         lon=locations[station][1]
-    lats = sa_obj.loc[0]
-    lons = sa_obj.loc[1]
-    Hs = sa_obj.Hs
-    time = sa_obj.time
-    sample = []
-    dists = []
-    for i in range(len(lats)):
-        if ((lats[i] < lat+1) and (lats[i] > lat-1)):
-            if ((lons[i] < lon+1) and (lons[i] > lon-1)):
-                dist=haversine(lons[i],lats[i],lon,lat)
-                if (dist<=distlim):
-                    sample.append(Hs[i])
-                    dists.append(dist)
+    lats = np.array(sa_obj.loc[0])
+    lons = np.array(sa_obj.loc[1])
+    Hs = np.array(sa_obj.Hs)
+    # box constraint to reduce workload
+    idx = np.where((lats < lat+1) & (lats > lat-1)
+                 & (lons < lon+1) & (lons > lon-1))[0]
+    dists = haversine_point(lon,lat,lons[idx],lats[idx])
+    sample = list(Hs[idx][dists<=distlim])
+    dists = list(dists[dists<=distlim])
     return sample, dists
@@ -7,6 +7,8 @@ purpose: mv files to sub-folders of year and month
 import numpy as np
 import os
 
+from catalogmod import get_localpath
+
 # flatten lists
 flatten = lambda l: [item for sublist in l for item in sublist]
 
@@ -19,15 +21,16 @@ def get_localfiles():
     return dirpath,filelst
 
 def sort_files(dirpath,filelst):
+    """
+    move swath files to dirpath/year/month using atomic renames
+    """
     for e in filelst:
-        if os.path.isfile(dirpath + '/' + e):
-            tmp = 'global_vavh_l3_rt_' + os.path.basename(dirpath) + '_'
-            year, month = e[len(tmp):len(tmp)+4],e[len(tmp)+4:len(tmp)+6]
-            folder = (dirpath + '/' + year + '/' + month)
-            cmd = 'mkdir -p ' + folder
-            os.system(cmd)
-            cmd = 'mv ' + e + ' ' + folder 
-            os.system(cmd)
+        if (e.endswith('.nc') and os.path.isfile(os.path.join(dirpath,e))):
+            target = get_localpath(dirpath,e)
+            if target == os.path.join(dirpath,e):
+                continue
+            os.makedirs(os.path.dirname(target),exist_ok=True)
+            os.replace(os.path.join(dirpath,e),target)
 
 if __name__ == "__main__":
     dirpath, filelst = get_localfiles()
@@ -73,54 +73,29 @@ def matchtime(sdate,edate,time,basetime=None,timewin=None):
     requested time including the respective time stamp(s). 
     Similarily, indices are chosen for the time and defined region.
     '''
+    from utils import timewin_idx, idx_array, seconds_to_dtime
     if timewin is None:
         timewin = 0
-    # create list of datetime instances
-    timelst=[]
-    ctime=[]
-    cidx=[]
-    idx=0
-    if (edate is None or sdate==edate):
-        for element in time:
-            if basetime is None:
-                tmp = element
-            else:
-                tmp = basetime + timedelta(seconds=element)
-            timelst.append(tmp)
-            # choose closest match within window of win[minutes]
-            if (tmp >= sdate-timedelta(minutes=timewin)
-            and tmp <= sdate+timedelta(minutes=timewin)):
-                ctime.append(tmp)
-                cidx.append(idx)
-            del tmp
-            idx=idx+1
-    if (edate is not None and edate!=sdate):
-        for element in time:
-            if basetime is None:
-                tmp = element
-            else:
-                tmp = basetime + timedelta(seconds=element)
-            timelst.append(tmp)
-            if (tmp >= sdate-timedelta(minutes=timewin)
-            and tmp < edate+timedelta(minutes=timewin)):
-                ctime.append(tmp)
-                cidx.append(idx)
-            del tmp
-            idx=idx+1
+    # right boundary is included for single time steps
+    closed = (edate is None or sdate==edate)
+    if basetime is None:
+        # time is given as datetime objects
+        idx = timewin_idx(time,sdate,edate,timewin=timewin,closed=closed)
+        cidx = idx_array(idx,len(time))
+        ctime = list(np.array(time,dtype=object)[cidx])
+    else:
+        idx = timewin_idx(time,sdate,edate,timewin=timewin,
+                          basetime=basetime,closed=closed)
+        cidx = idx_array(idx,len(time))
+        ctime = seconds_to_dtime(np.asarray(time)[cidx],basetime)
     return ctime, cidx
 
 def get_loc_idx(init_lats,init_lons,target_lat,target_lon,mask=None):
-    from utils import haversine
-    distM = np.zeros(init_lats.shape)*np.nan
-    for i in range(init_lats.shape[0]):
-        for j in range(init_lats.shape[1]):
-            if mask is None:
-                distM[i,j] = haversine(init_lons[i,j],init_lats[i,j],
-                                    target_lon,target_lat)
-            else:
-                if isinstance(mask[i,j],(np.float32)):
-                    distM[i,j] = haversine(init_lons[i,j],init_lats[i,j],
-                                    target_lon,target_lat)
+    from utils import haversine_point
+    distM = haversine_point(target_lon,target_lat,init_lons,init_lats)
+    if mask is not None:
+        # only unmasked grid points are considered
+        distM[np.ma.getmaskarray(mask)] = np.nan
     idx,idy = np.where(distM==np.nanmin(distM))
     return idx, idy, distM, init_lats[idx,idy], init_lons[idx,idy]
 
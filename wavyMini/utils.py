@@ -7,31 +7,23 @@ from math import radians, cos, sin, asin, sqrt, floor
 import sys
 
 def block_detection(time,deltalim=None):
+    """
+    detect blocks of consecutive time steps separated by gaps
+    larger than deltalim
+    returns indices after and before each gap and list of
+    [first,last] index of blocks, empty if there is no gap
+    """
     if deltalim is None:
         deltalim = 1
+    gaps = np.where(np.diff(np.asarray(time)) > deltalim)[0]
     # forward check
-    idx_a = []
-    for i in range(1,len(time)):
-        delta_t = time[i]-time[i-1]
-        if delta_t>deltalim:
-            idx_a.append(i)
+    idx_a = [int(i) for i in gaps + 1]
     # backward check
-    idx_b = []
-    for i in range(0,len(time)-1):
-        delta_t = time[i+1]-time[i]
-        if delta_t>deltalim:
-            idx_b.append(i)
+    idx_b = [int(i) for i in gaps]
     blocklst = []
-    for i in range(len(idx_a)):
-        if i == 0:
-            tmp = [0,idx_b[i]]
-            blocklst.append(tmp)
-        if i < len(idx_a)-1:
-            tmp = [idx_a[i],idx_b[i+1]]
-            blocklst.append(tmp)
-        if i == len(idx_a)-1:
-            tmp = [idx_a[i],len(time)-1]
-            blocklst.append(tmp)
+    if len(idx_a) > 0:
+        blocklst = [[s,e] for s, e in zip([0] + idx_a,
+                                          idx_b + [len(time)-1])]
     return idx_a, idx_b, blocklst
 
 def identify_outliers(time,ts,ts_ref=None,hs_ll=None,hs_ul=None,dt=None,block=None):
@@ -156,6 +148,52 @@ def haversine(lon1, lat1, lon2, lat2):
     km = 6367 * c
     return km
 
+def haversine_pairwise(lon1, lat1, lon2, lat2, dtype=None):
+    """
+    Vectorized version of haversine for aligned arrays,
+    input is broadcasted following numpy rules
+    dtype -> 'float64' (default) or 'float32' to save memory
+    """
+    if dtype is None:
+        dtype = 'float64'
+    lon1, lat1, lon2, lat2 = [np.radians(np.asarray(e,dtype=dtype))
+                              for e in (lon1, lat1, lon2, lat2)]
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = (np.sin(dlat/2)**2
+        + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2)
+    c = 2 * np.arcsin(np.sqrt(np.clip(a,0,1)))
+    km = np.asarray(6367 * c, dtype=dtype)
+    return km
+
+def haversine_point(lon, lat, lons, lats, dtype=None):
+    """
+    Distances in km from one point to many points
+    """
+    return haversine_pairwise(lon, lat, lons, lats, dtype=dtype)
+
+def haversine_matrix(lons1, lats1, lons2, lats2, dtype=None, block=None):
+    """
+    Distance matrix in km between two sets of points, computed
+    in blocks of rows to limit the size of temporary arrays
+    block -> number of rows of the first set per block
+    """
+    if dtype is None:
+        dtype = 'float64'
+    if block is None:
+        block = 1024
+    lons1, lats1 = np.ravel(lons1), np.ravel(lats1)
+    lons2, lats2 = np.ravel(lons2), np.ravel(lats2)
+    distM = np.empty((len(lons1),len(lons2)),dtype=dtype)
+    for i in range(0,len(lons1),block):
+        distM[i:i+block,:] = haversine_pairwise(
+                                lons1[i:i+block,None],
+                                lats1[i:i+block,None],
+                                lons2[None,:],
+                                lats2[None,:],
+                                dtype=dtype)
+    return distM
+
 def rmsd(a,b):
     '''
     root mean square deviation
@@ -315,3 +353,73 @@ def hour_rounder(t):
     return (t.replace(second=0, microsecond=0, minute=0, hour=t.hour)
                +timedelta(hours=t.minute//30))
 
+
+def to_seconds(time,basetime=None):
+    """
+    convert datetime objects or datetime64 to float seconds since
+    basetime, numbers are assumed to be seconds already
+    """
+    time = np.asarray(time)
+    if basetime is None:
+        basetime = datetime(2000,1,1)
+    if (time.dtype == object or np.issubdtype(time.dtype,np.datetime64)):
+        time = ((time.astype('datetime64[us]')
+                - np.datetime64(basetime,'us'))
+                / np.timedelta64(1,'s'))
+    return time.astype('float64')
+
+def seconds_to_dtime(time,basetime):
+    """
+    convert seconds since basetime to a list of datetime objects
+    """
+    return list(seconds_to_datetime64(time,basetime).tolist())
+
+def seconds_to_datetime64(time,basetime):
+    """
+    convert seconds since basetime to datetime64 with microsecond
+    precision rounded like datetime.timedelta
+    """
+    time = np.asarray(time,dtype='float64')
+    secs = np.floor(time)
+    usecs = np.round((time - secs)*1e6)
+    return (np.datetime64(basetime,'us')
+            + secs.astype('int64').astype('timedelta64[s]')
+            + usecs.astype('int64').astype('timedelta64[us]'))
+
+def timewin_idx(time,sdate,edate=None,timewin=None,basetime=None,
+    closed=None):
+    """
+    vectorized search for all time steps within
+    [sdate-timewin,edate+timewin) or [sdate-timewin,edate+timewin]
+    time -> seconds since basetime or datetime objects
+    closed -> include right boundary
+    returns a slice if time is sorted, otherwise an index array
+    """
+    if timewin is None:
+        timewin = 0
+    if edate is None:
+        edate = sdate
+    if closed is None:
+        closed = False
+    if basetime is None:
+        basetime = datetime(2000,1,1)
+    time = to_seconds(time,basetime)
+    start = (sdate - timedelta(minutes=timewin)
+            - basetime).total_seconds()
+    end = (edate + timedelta(minutes=timewin)
+          - basetime).total_seconds()
+    if len(time) < 2 or np.all(time[1:] >= time[:-1]):
+        side = 'right' if closed else 'left'
+        return slice(int(np.searchsorted(time,start,side='left')),
+                     int(np.searchsorted(time,end,side=side)))
+    if closed:
+        return np.where((time >= start) & (time <= end))[0]
+    return np.where((time >= start) & (time < end))[0]
+
+def idx_array(idx,length):
+    """
+    return indices as an array, slices are expanded
+    """
+    if isinstance(idx,slice):
+        return np.arange(length)[idx]
+    return np.asarray(idx,dtype=int)